@@ -1,8 +1,23 @@
 import os
 import signal
-from flask import Flask, request, Response, jsonify
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Flask, request, Response, jsonify, g
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from werkzeug.http import unquote_etag
 import coverage as _coverage
+try:
+    import brotli
+except ImportError:  # br is simply not offered without the Brotli package
+    brotli = None
+import auth_cache
+from cache import ResponseCache, auth_scope
+from singleflight import SingleFlight
+from upstreams import Unavailable, UpstreamPool
 
 
 app = Flask(__name__)
@@ -11,91 +26,489 @@ USER_SERVICE_URL = os.environ.get('USER_SERVICE_URL', 'http://user_service:8082/
 PRODUCT_SERVICE_URL = os.environ.get('PRODUCT_SERVICE_URL', 'http://product_service:8081/api/v1')
 ORDER_SERVICE_URL = os.environ.get('ORDER_SERVICE_URL', 'http://order_service:8080/api/v1')
 
+# Each *_SERVICE_URL may list several replicas, separated by commas or spaces
+UPSTREAM_LB_STRATEGY = os.environ.get('UPSTREAM_LB_STRATEGY', 'p2c')
+UPSTREAM_EJECT_FAILURES = int(os.environ.get('UPSTREAM_EJECT_FAILURES', '3'))
+UPSTREAM_EJECT_SECONDS = float(os.environ.get('UPSTREAM_EJECT_SECONDS', '10'))
+# Attempts per idempotent GET when a replica refuses the connection (or is hedged)
+UPSTREAM_MAX_TRIES = int(os.environ.get('UPSTREAM_MAX_TRIES', '2'))
+# Per-upstream circuit breaker and in-flight cap (0 = unlimited); both fail fast with 503
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', '5'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', '10'))
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', '64'))
+# Hedged GETs: after the upstream's p95 latency, race a second replica
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', '0.05'))
+HEDGE_WORKERS = int(os.environ.get('HEDGE_WORKERS', '64'))
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge') if HEDGE_ENABLED else None
+
+
+def _upstream_pool(name, urls):
+    return UpstreamPool(name, urls, strategy=UPSTREAM_LB_STRATEGY,
+                        eject_failures=UPSTREAM_EJECT_FAILURES, eject_seconds=UPSTREAM_EJECT_SECONDS,
+                        breaker_failures=BREAKER_FAILURES, breaker_open_seconds=BREAKER_OPEN_SECONDS,
+                        max_concurrency=UPSTREAM_MAX_CONCURRENCY, hedge_min_delay=HEDGE_MIN_DELAY)
+
+
+user_upstream = _upstream_pool('user_service', USER_SERVICE_URL)
+product_upstream = _upstream_pool('product_service', PRODUCT_SERVICE_URL)
+order_upstream = _upstream_pool('order_service', ORDER_SERVICE_URL)
+
 
 def _forward_headers():
-    # Forward only safe headers; include Authorization, Content-Type, Accept, Idempotency-Key
+    # Forward only safe headers; include Authorization, Content-Type, Accept, Idempotency-Key, If-None-Match
     headers = {}
-    for h in ('Authorization', 'Content-Type', 'Accept', 'Idempotency-Key'):
+    for h in ('Authorization', 'Content-Type', 'Accept', 'Idempotency-Key', 'If-None-Match'):
         v = request.headers.get(h)
         if v:
             headers[h] = v
+    if g.get('identity'):
+        headers[auth_cache.IDENTITY_HEADER] = g.identity
+    # Ask upstream only for the encoding negotiated with the client (or none), so
+    # an upstream-compressed body can be relayed as-is
+    headers['Accept-Encoding'] = _negotiate_encoding() or 'identity'
     return headers
 
 
-def _proxy(base_url: str, subpath: str | None = None):
-    url = base_url if not subpath else f"{base_url.rstrip('/')}/{subpath}"
+# Edge authentication: with GATEWAY_AUTH=1 bearer tokens are verified (and
+# cached) here and bad ones rejected before reaching a service; with
+# IDENTITY_SECRET also set, the verified claims are forwarded as a signed
+# X-Identity header that services accept without re-verifying the JWT
+GATEWAY_AUTH = os.environ.get('GATEWAY_AUTH', '0').lower() in ('1', 'true', 'yes')
+JWT_SECRET = os.environ.get('JWT_SECRET', 'dev-secret-change-me')
+JWT_ALG = 'HS256'
+gateway_auth = auth_cache.authenticator_from_env(JWT_SECRET, JWT_ALG) if GATEWAY_AUTH else None
+
+
+# Upstream response headers relayed to the client
+RESPONSE_HEADERS = ('Content-Type', 'Content-Encoding', 'X-Next-Cursor', 'ETag')
+
+# Negotiated response compression
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+COMPRESS_TYPES = ('application/json', 'application/x-ndjson', 'application/yaml', 'application/xml', 'application/javascript')
+# Server preference order on ties in the client's q-values
+COMPRESS_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _negotiate_encoding():
+    if not COMPRESS_ENABLED:
+        return None
+    return request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+
+
+def _compressible(headers):
+    ctype = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    return ctype.startswith('text/') or ctype.endswith('+json') or ctype in COMPRESS_TYPES
+
+
+def _compressor(encoding):
+    """(feed, finish) callables of a streaming encoder for `encoding`."""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return c.compress, c.flush
+
+
+def _compress_stream(chunks, encoding):
+    feed, finish = _compressor(encoding)
+    for chunk in chunks:
+        out = feed(chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def _weaken_etag(headers):
+    # The upstream's strong ETag names its identity bytes, not our compressed ones
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+
+
+def _encode(result, encoding):
+    """Compress an upstream result for the client unless it is already encoded,
+    below COMPRESS_MIN_BYTES or not a text-like type. The ETag of a body
+    compressed here is weakened.
+    """
+    status, headers, body, stream = result
+    if status == 304:
+        # Echo the validator in the form the client holds it (weak if we compressed the 200)
+        etag = headers.get('ETag')
+        if etag and request.if_none_match.is_weak(unquote_etag(etag)[0]):
+            _weaken_etag(headers)
+        return result
+    if not COMPRESS_ENABLED or not _compressible(headers):
+        return result
+    headers['Vary'] = 'Accept-Encoding'
+    if encoding is None or 'Content-Encoding' in headers:
+        return result
+    size = len(body) if body is not None else headers.get('Content-Length')
+    if size is not None and int(size) < COMPRESS_MIN_BYTES:
+        return result
+    headers['Content-Encoding'] = encoding
+    _weaken_etag(headers)
+    if body is not None:
+        feed, finish = _compressor(encoding)
+        return status, headers, feed(body) + finish(), None
+    headers.pop('Content-Length', None)
+    chunks, close = stream
+    return status, headers, None, (_compress_stream(chunks, encoding), close)
+
+
+# Keep-alive connection pools, one Session per upstream replica
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', '32'))
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', '15'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '3'))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', str(64 * 1024)))
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _session_for(base_url: str) -> requests.Session:
+    session = _sessions.get(base_url)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=UPSTREAM_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[base_url] = session
+    return session
+
+
+# Catalog read cache; TTLs (seconds) per route, matched on the longest subpath prefix
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+CACHE_ROUTE_TTLS = {
+    'products/search': float(os.environ.get('CACHE_TTL_PRODUCT_SEARCH', '10')),
+    'products': float(os.environ.get('CACHE_TTL_PRODUCTS', '30')),
+}
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get('CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    max_entry_bytes=int(os.environ.get('CACHE_MAX_ENTRY_BYTES', str(1024 * 1024))),
+)
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def _cache_ttl(subpath):
+    if not CACHE_ENABLED or not subpath:
+        return None
+    for prefix in sorted(CACHE_ROUTE_TTLS, key=len, reverse=True):
+        if subpath == prefix or subpath.startswith(prefix + '/'):
+            return CACHE_ROUTE_TTLS[prefix] or None
+    return None
+
+
+def _cached_response(entry):
+    etag = entry.headers.get('ETag')
+    if etag and request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+        # The client already holds this representation
+        out = Response(status=304, headers={'ETag': etag})
+    else:
+        out = Response(entry.body, status=entry.status, headers=entry.headers)
+    out.headers['X-Cache'] = 'HIT'
+    out.headers['Age'] = str(int(time.monotonic() - entry.stored_at))
+    return out
+
+
+# Identical concurrent GETs share one upstream call
+COALESCE_ENABLED = os.environ.get('COALESCE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+COALESCE_MAX_WAITERS = int(os.environ.get('COALESCE_MAX_WAITERS', '1000'))
+# Responses larger than this are streamed to the leader only; waiters then fetch their own
+COALESCE_MAX_BYTES = int(os.environ.get('COALESCE_MAX_BYTES', str(1024 * 1024)))
+# Request headers that must match for two GETs to share a response
+COALESCE_VARY_HEADERS = tuple(
+    h.strip() for h in os.environ.get('COALESCE_VARY_HEADERS', 'Authorization,Accept').split(',') if h.strip()
+)
+coalescer = SingleFlight(max_waiters=COALESCE_MAX_WAITERS)
+
+
+def default_coalesce_key(url):
+    """Key on the logical upstream URL, normalized query and COALESCE_VARY_HEADERS.
+    Swap app.coalesce_key for a different policy; returning None opts a request out.
+    """
+    vary = tuple(
+        auth_scope(request.headers.get(h)) if h.lower() == 'authorization' else request.headers.get(h, '')
+        for h in COALESCE_VARY_HEADERS
+    )
+    return ResponseCache.key('GET', url, request.args, vary)
+
+
+coalesce_key = default_coalesce_key
+
+
+def _send(upstream, replica, subpath, method, params, data, headers):
+    """One HTTP exchange with a replica; safe to run off the request thread."""
+    started = time.monotonic()
+    resp = _session_for(replica.base_url).request(
+        method,
+        replica.url(subpath),
+        params=params,
+        data=data,
+        headers=headers,
+        timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_TIMEOUT),
+        stream=True,
+    )
+    if resp.status_code < 500:
+        upstream.observe(time.monotonic() - started)
+    return resp
+
+
+def _abandon(upstream, attempt, future):
+    # Loser of a hedged race: drop its response without counting it either way
+    if future.cancelled() or future.exception() is not None:
+        upstream.release(attempt, None)
+        return
+    future.result().close()
+    upstream.release(attempt, None)
+
+
+def _hedged_get(upstream, send):
+    """Race GET attempts across replicas. A new attempt on another replica
+    starts when every running one has failed to connect or, once the
+    upstream's latency window is warm, when none answered within its p95.
+    The first response wins and the others are abandoned.
+    """
+    tried, pending = [], {}
+    error = None
+
+    def launch():
+        attempt = upstream.acquire(exclude=tried)
+        tried.append(attempt.replica)
+        pending[_hedge_pool.submit(send, attempt.replica)] = attempt
+
+    launch()
+    delay = upstream.hedge_delay()
+    while pending:
+        can_launch = len(tried) < min(UPSTREAM_MAX_TRIES, len(upstream))
+        done, _ = wait(pending, timeout=delay if can_launch else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            attempt = pending.pop(future)
+            try:
+                resp = future.result()
+            except requests.RequestException as e:
+                upstream.release(attempt, ok=False)
+                error = e
+                continue
+            for other, other_attempt in pending.items():
+                other.cancel()
+                other.add_done_callback(lambda f, a=other_attempt: _abandon(upstream, a, f))
+            return attempt, resp
+        retry = not pending and isinstance(error, requests.ConnectionError)
+        if can_launch and (not done or retry):
+            try:
+                launch()
+            except Unavailable:
+                if not pending:
+                    raise
+                delay = None
+    raise error
+
+
+def _call_upstream(upstream, subpath, method, data, buffer_limit=0):
+    """Send the current request to a replica of `upstream`. Returns
+    (status, headers, body, stream): body is the full payload when it fits in
+    buffer_limit, otherwise None and stream is (chunk iterator, close callback).
+    Connection failures on a GET are retried on another replica, and slow
+    GETs are hedged when HEDGE_ENABLED. Raises Unavailable if the upstream's
+    circuit is open or it is saturated.
+    """
+    params, headers = request.args, _forward_headers()
+
+    def send(replica):
+        return _send(upstream, replica, subpath, method, params, data, headers)
+
+    if _hedge_pool is not None and method == 'GET' and len(upstream) > 1:
+        attempt, resp = _hedged_get(upstream, send)
+    else:
+        tried = []
+        while True:
+            attempt = upstream.acquire(exclude=tried)
+            try:
+                resp = send(attempt.replica)
+            except requests.ConnectionError:
+                upstream.release(attempt, ok=False)
+                tried.append(attempt.replica)
+                if method == 'GET' and len(tried) < min(UPSTREAM_MAX_TRIES, len(upstream)):
+                    continue
+                raise
+            except requests.RequestException:
+                upstream.release(attempt, ok=False)
+                raise
+            break
+
+    ok = resp.status_code < 500
+    headers = {h: resp.headers[h] for h in RESPONSE_HEADERS if h in resp.headers}
+    if headers.get('Content-Encoding', '').lower() == 'identity':
+        del headers['Content-Encoding']
+    # Bodies are relayed as received (decode_content=False): an upstream-compressed
+    # body is never inflated and recompressed here
+    length = resp.headers.get('Content-Length')
+    if buffer_limit and length is not None and int(length) <= buffer_limit:
+        try:
+            body = resp.raw.read(decode_content=False)
+            resp.close()
+        except urllib3.exceptions.HTTPError as e:
+            ok = False
+            raise requests.ConnectionError(e) from e
+        finally:
+            upstream.release(attempt, ok)
+        return resp.status_code, headers, body, None
+
+    def close():
+        # The request stays outstanding on the replica until the body is relayed
+        resp.close()
+        upstream.release(attempt, ok)
+
+    if length is not None:
+        headers['Content-Length'] = length
+    return resp.status_code, headers, None, (resp.raw.stream(STREAM_CHUNK_SIZE, decode_content=False), close)
+
+
+def _proxy(upstream: UpstreamPool, subpath: str | None = None):
+    url = upstream.name if not subpath else f"{upstream.name}/{subpath}"
     method = request.method
 
+    if gateway_auth is not None:
+        token = auth_cache.Authenticator.bearer(request.headers)
+        if token:
+            identity = gateway_auth.edge_verify(token)
+            if identity is None:
+                return jsonify({'error': 'Unauthorized'}), 401
+            g.identity = identity
+
+    encoding = _negotiate_encoding()
+    ttl = _cache_ttl(subpath) if method == 'GET' else None
+    buffer_limit = 0
+    if ttl:
+        cache_key = ResponseCache.key(method, subpath, request.args, (auth_scope(request.headers.get('Authorization')), encoding))
+        entry = response_cache.get(cache_key)
+        if entry is not None:
+            return _cached_response(entry)
+        generation = response_cache.generation(subpath)
+        buffer_limit = response_cache.max_entry_bytes
+
+    flight_key = coalesce_key(url) if COALESCE_ENABLED and method == 'GET' else None
+    if flight_key is not None:
+        buffer_limit = max(buffer_limit, COALESCE_MAX_BYTES)
+        if subpath:
+            # Never join a call that started before a write seen by this gateway
+            flight_key = (flight_key, response_cache.generation(subpath))
+        # A conditional GET may be answered 304, which only suits callers sending the same validator
+        flight_key = (flight_key, encoding, request.headers.get('If-None-Match'))
+
     data = None
-    json_body = None
     if request.method in ('POST', 'PUT', 'PATCH'):
-        # Prefer JSON if provided
-        json_body = request.get_json(silent=True)
-        if json_body is None:
-            data = request.get_data()
+        # Pass the body through untouched; Content-Type is forwarded as-is
+        data = request.get_data()
 
+    def fetch():
+        # Compressed once here, so cache entries and coalesced waiters share the encoded body
+        return _encode(_call_upstream(upstream, subpath, method, data, buffer_limit), encoding)
+
+    coalesced = False
     try:
-        resp = requests.request(
-            method,
-            url,
-            params=request.args,
-            json=json_body,
-            data=data,
-            headers=_forward_headers(),
-            timeout=15,
-        )
+        if flight_key is None:
+            status, headers, body, stream = fetch()
+        else:
+            (status, headers, body, stream), leader = coalescer.do(flight_key, fetch)
+            coalesced = not leader
+            if coalesced and body is None:
+                # The leader's response was too large to share
+                status, headers, body, stream = fetch()
+                coalesced = False
+    except Unavailable as e:
+        return jsonify({'error': f'Upstream unavailable: {e}'}), 503, {'Retry-After': str(e.retry_after)}
     except requests.RequestException as e:
         return jsonify({'error': f'Upstream unavailable: {e}'}), 502
+    finally:
+        if method in WRITE_METHODS and subpath:
+            # Writes (incl. reserve/release) make cached reads in the namespace stale
+            response_cache.invalidate(subpath)
 
-    # Build Flask Response with upstream status and content-type
-    headers = {}
-    if 'Content-Type' in resp.headers:
-        headers['Content-Type'] = resp.headers['Content-Type']
-    return Response(resp.content, status=resp.status_code, headers=headers)
+    if body is not None:
+        out = Response(body, status=status, headers=headers)
+        if ttl:
+            if status == 200 and not coalesced:
+                response_cache.put(cache_key, body, status, headers, ttl, generation)
+            out.headers['X-Cache'] = 'MISS' if status == 200 else 'BYPASS'
+    else:
+        # The body is streamed chunk by chunk and the upstream connection
+        # returned to the pool afterwards
+        chunks, close = stream
+        out = Response(chunks, status=status, headers=headers)
+        if ttl:
+            out.headers['X-Cache'] = 'BYPASS'
+        out.call_on_close(close)
+    if coalesced:
+        out.headers['X-Coalesced'] = 'true'
+    return out
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        'status': 'ok',
+        'cache': response_cache.stats(),
+        'coalescing': coalescer.stats(),
+        'upstreams': {u.name: u.stats() for u in (user_upstream, product_upstream, order_upstream)},
+        'auth': gateway_auth.stats() if gateway_auth is not None else None,
+    }), 200
 
 
 # Users
 @app.route('/api/v1/login', methods=['POST'])
 def gw_login():
     # Forward login to user-service without auth requirement
-    return _proxy(USER_SERVICE_URL, 'login')
+    return _proxy(user_upstream, 'login')
+
+@app.route('/api/v1/token/<path:subpath>', methods=['POST'])
+def gw_token(subpath):
+    # Refresh-token rotation and revocation live on the user-service
+    return _proxy(user_upstream, f"token/{subpath}")
+
 
 @app.route('/api/v1/users', methods=['GET', 'POST'])
 def gw_users_root():
     # Forward to /api/v1/users on the user-service
-    return _proxy(USER_SERVICE_URL, 'users')
+    return _proxy(user_upstream, 'users')
 
 
 @app.route('/api/v1/users/<path:subpath>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
 def gw_users(subpath):
     # Always include the users/ prefix when forwarding
-    return _proxy(USER_SERVICE_URL, f"users/{subpath}")
+    return _proxy(user_upstream, f"users/{subpath}")
 
 
 # Products
 @app.route('/api/v1/products', methods=['GET', 'POST'])
 def gw_products_root():
     # Forward to /api/v1/products on the product-service
-    return _proxy(PRODUCT_SERVICE_URL, 'products')
+    return _proxy(product_upstream, 'products')
 
 
 @app.route('/api/v1/products/<path:subpath>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
 def gw_products(subpath):
     # Always include the products/ prefix when forwarding
-    return _proxy(PRODUCT_SERVICE_URL, f"products/{subpath}")
+    return _proxy(product_upstream, f"products/{subpath}")
 
 
 # Orders
 @app.route('/api/v1/orders', methods=['GET', 'POST'])
 def gw_orders_root():
     # Forward to /api/v1/orders on the order-service
-    return _proxy(ORDER_SERVICE_URL, 'orders')
+    return _proxy(order_upstream, 'orders')
 
 
 @app.route('/api/v1/orders/<path:subpath>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
 def gw_orders(subpath):
     # Always include the orders/ prefix when forwarding
-    return _proxy(ORDER_SERVICE_URL, f"orders/{subpath}")
+    return _proxy(order_upstream, f"orders/{subpath}")
 
 
 
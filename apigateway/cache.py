@@ -0,0 +1,105 @@
+"""In-memory response cache for idempotent catalog reads.
+
+Entries are keyed on (method, path, normalized query, auth scope), expire after
+a per-route TTL and are evicted LRU once the total cached body size passes
+max_bytes. Each namespace (first path segment, e.g. 'products') carries a
+generation counter: a write through the namespace bumps it and drops its
+entries, and fills started before the bump are discarded so a read racing a
+write cannot re-insert the stale body.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedResponse:
+    __slots__ = ('body', 'status', 'headers', 'stored_at', 'expires_at')
+
+    def __init__(self, body, status, headers, ttl):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+
+
+def namespace_of(path):
+    return path.strip('/').split('/', 1)[0]
+
+
+def auth_scope(authorization):
+    """Digest of the Authorization header, so tokens never sit in memory as keys."""
+    if not authorization:
+        return ''
+    return hashlib.sha256(authorization.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self.max_entry_bytes = int(max_entry_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def key(method, path, args, scope):
+        # Sorted (name, value) pairs so ?a=1&b=2 and ?b=2&a=1 share an entry
+        query = tuple(sorted((k, v) for k in args for v in args.getlist(k)))
+        return (method, path, query, scope)
+
+    def generation(self, path):
+        with self._lock:
+            return self._generations.get(namespace_of(path), 0)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, body, status, headers, ttl, generation):
+        """Store a response unless it is too large or its namespace changed since `generation`."""
+        if len(body) > self.max_entry_bytes:
+            return False
+        with self._lock:
+            if self._generations.get(namespace_of(key[1]), 0) != generation:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = CachedResponse(body, status, headers, ttl)
+            self._bytes += len(body)
+            self._stats['stores'] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+            return True
+
+    def invalidate(self, path):
+        """Drop every entry in the path's namespace and bump its generation."""
+        ns = namespace_of(path)
+        with self._lock:
+            self._generations[ns] = self._generations.get(ns, 0) + 1
+            for key in [k for k in self._entries if namespace_of(k[1]) == ns]:
+                self._drop(key)
+            self._stats['invalidations'] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({'entries': len(self._entries), 'bytes': self._bytes, 'maxBytes': self.max_bytes})
+        return out
@@ -0,0 +1,67 @@
+"""Request coalescing: concurrent identical calls share one execution.
+
+The first caller for a key (the leader) runs the function; callers arriving
+while it is in flight wait and receive the same result or exception. Once
+max_waiters are queued on a key, further callers run the function
+themselves rather than piling onto one slow call.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, max_waiters=1000):
+        self.max_waiters = int(max_waiters)
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'coalesced': 0, 'overflow': 0}
+
+    def do(self, key, fn):
+        """Run fn() once per in-flight key. Returns (result, leader) where
+        leader is False if the result was produced by another caller's fn().
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self._stats['leaders'] += 1
+            elif call.waiters >= self.max_waiters:
+                call = None
+                self._stats['overflow'] += 1
+            else:
+                call.waiters += 1
+                leader = False
+                self._stats['coalesced'] += 1
+        if call is None:
+            return fn(), True
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.event.set()
+            return call.result, True
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['inFlight'] = len(self._calls)
+        return out
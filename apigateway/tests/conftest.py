@@ -0,0 +1,18 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(SERVICE_DIR), 'common'))
+
+
+@pytest.fixture(scope='session')
+def gateway():
+    # Loaded under its own name: every service has an app.py
+    spec = importlib.util.spec_from_file_location('apigateway_app', os.path.join(SERVICE_DIR, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,42 @@
+import gzip
+
+from cache import CachedResponse
+
+BODY = b'{"items":[' + b'{"id":"p","name":"x"},' * 200 + b'{}]}'
+
+
+def encode(gateway, status, headers, body=BODY, request_headers=None):
+    with gateway.app.test_request_context(headers=request_headers or {'Accept-Encoding': 'gzip'}):
+        return gateway._encode((status, dict(headers), body, None), gateway._negotiate_encoding())
+
+
+def test_compressed_body_gets_weak_etag(gateway):
+    status, headers, body, _ = encode(gateway, 200, {'Content-Type': 'application/json', 'ETag': '"v1"'})
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['ETag'] == 'W/"v1"'
+    assert gzip.decompress(body) == BODY
+
+
+def test_identity_body_keeps_strong_etag(gateway):
+    _, headers, _, _ = encode(gateway, 200, {'Content-Type': 'application/json', 'ETag': '"v1"'},
+                              request_headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in headers
+    assert headers['ETag'] == '"v1"'
+
+
+def test_relayed_304_echoes_weak_tag(gateway):
+    _, headers, _, _ = encode(gateway, 304, {'ETag': '"v1"'}, b'',
+                              request_headers={'Accept-Encoding': 'gzip', 'If-None-Match': 'W/"v1"'})
+    assert headers['ETag'] == 'W/"v1"'
+
+
+def test_cached_304_uses_cached_etag(gateway):
+    _, headers, body, _ = encode(gateway, 200, {'Content-Type': 'application/json', 'ETag': '"v1"'})
+    entry = CachedResponse(body, 200, headers, 30)
+    with gateway.app.test_request_context(headers={'If-None-Match': headers['ETag']}):
+        out = gateway._cached_response(entry)
+    assert out.status_code == 304
+    assert out.headers['ETag'] == 'W/"v1"'
+    with gateway.app.test_request_context(headers={'If-None-Match': '"v2"'}):
+        out = gateway._cached_response(entry)
+    assert out.status_code == 200
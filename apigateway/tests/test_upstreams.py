@@ -0,0 +1,217 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from upstreams import Unavailable, UpstreamPool
+
+
+def pool(urls='http://a', **kwargs):
+    kwargs.setdefault('breaker_failures', 2)
+    kwargs.setdefault('breaker_open_seconds', 60)
+    kwargs.setdefault('eject_failures', 100)
+    return UpstreamPool('svc', urls, **kwargs)
+
+
+def expire(upstream):
+    upstream._opened_until = time.monotonic() - 1
+
+
+def test_breaker_opens_after_consecutive_failures():
+    upstream = pool()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    with pytest.raises(Unavailable) as e:
+        upstream.acquire()
+    assert e.value.reason == 'circuit open'
+    assert upstream.stats()['breakerOpens'] == 1
+
+
+def test_success_resets_failure_count():
+    upstream = pool()
+    upstream.release(upstream.acquire(), False)
+    upstream.release(upstream.acquire(), True)
+    upstream.release(upstream.acquire(), False)
+    assert upstream.stats()['breaker'] == 'closed'
+
+
+def test_half_open_admits_one_trial():
+    upstream = pool()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    expire(upstream)
+    trial = upstream.acquire()
+    with pytest.raises(Unavailable):
+        upstream.acquire()
+    upstream.release(trial, True)
+    assert upstream.stats()['breaker'] == 'closed'
+    upstream.release(upstream.acquire(), True)
+
+
+def test_failed_trial_reopens():
+    upstream = pool()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    expire(upstream)
+    upstream.release(upstream.acquire(), False)
+    with pytest.raises(Unavailable):
+        upstream.acquire()
+    assert upstream.stats()['breakerOpens'] == 2
+
+
+def test_late_success_from_before_open_does_not_close():
+    upstream = pool()
+    early = upstream.acquire()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    upstream.release(early, True)
+    with pytest.raises(Unavailable):
+        upstream.acquire()
+
+
+def test_late_release_does_not_free_trial_slot():
+    upstream = pool()
+    early = upstream.acquire()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    expire(upstream)
+    trial = upstream.acquire()
+    upstream.release(early, True)
+    with pytest.raises(Unavailable):
+        upstream.acquire()
+    upstream.release(trial, True)
+    assert upstream.stats()['breaker'] == 'closed'
+
+
+def test_late_failure_does_not_reopen_after_trial_closed():
+    upstream = pool()
+    early = upstream.acquire()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    expire(upstream)
+    upstream.release(upstream.acquire(), True)
+    upstream.release(early, False)
+    upstream.release(upstream.acquire(), True)
+    assert upstream.stats()['breaker'] == 'closed'
+    assert upstream.stats()['breakerOpens'] == 1
+
+
+def test_abandoned_trial_frees_slot():
+    upstream = pool()
+    for _ in range(2):
+        upstream.release(upstream.acquire(), False)
+    expire(upstream)
+    upstream.release(upstream.acquire(), None)
+    assert upstream.stats()['breaker'] == 'half_open'
+    upstream.release(upstream.acquire(), True)
+    assert upstream.stats()['breaker'] == 'closed'
+
+
+def test_saturation():
+    upstream = pool(max_concurrency=1)
+    attempt = upstream.acquire()
+    with pytest.raises(Unavailable) as e:
+        upstream.acquire()
+    assert e.value.reason == 'saturated'
+    upstream.release(attempt, True)
+    upstream.release(upstream.acquire(), True)
+
+
+def test_ejected_replica_is_skipped_then_readmitted():
+    upstream = pool('http://a http://b', eject_failures=2, eject_seconds=60, breaker_failures=100)
+    a, b = upstream.replicas
+    for _ in range(2):
+        attempt = upstream.acquire(exclude=[b])
+        assert attempt.replica is a
+        upstream.release(attempt, False)
+    assert not upstream.stats()['replicas'][0]['healthy']
+    assert all(upstream.acquire().replica is b for _ in range(5))
+    a.ejected_until = time.monotonic() - 1
+    attempt = upstream.acquire(exclude=[b])
+    assert attempt.replica is a
+    # On probation: one more failure ejects it again
+    upstream.release(attempt, False)
+    assert a.ejections == 2
+
+
+def test_all_ejected_uses_soonest_back():
+    upstream = pool('http://a http://b', breaker_failures=100)
+    a, b = upstream.replicas
+    a.ejected_until = time.monotonic() + 10
+    b.ejected_until = time.monotonic() + 20
+    assert upstream.acquire().replica is a
+
+
+class FakeResponse:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def hedging(gateway, monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(gateway, '_hedge_pool', executor)
+    yield gateway
+    executor.shutdown(wait=True)
+
+
+def warmed(latency=0.01):
+    upstream = pool('http://a http://b', breaker_failures=100, hedge_min_delay=0.01)
+    for _ in range(upstream.hedge_min_samples):
+        upstream.observe(latency)
+    return upstream
+
+
+def test_hedge_races_slow_replica(hedging):
+    upstream = warmed()
+    slow = {}
+
+    def send(replica):
+        if not slow:
+            slow['replica'] = replica
+            time.sleep(0.3)
+        return FakeResponse(replica.base_url)
+
+    attempt, resp = hedging._hedged_get(upstream, send)
+    assert attempt.replica is not slow['replica']
+    assert resp.name == attempt.replica.base_url
+    upstream.release(attempt, True)
+    hedging._hedge_pool.shutdown(wait=True)
+    # The loser is released without counting as a success or failure
+    assert upstream.stats()['inFlight'] == 0
+    assert all(r.errors == 0 for r in upstream.replicas)
+
+
+def test_hedge_not_started_before_warm_up(hedging):
+    upstream = pool('http://a http://b', breaker_failures=100)
+    calls = []
+
+    def send(replica):
+        calls.append(replica)
+        time.sleep(0.05)
+        return FakeResponse(replica.base_url)
+
+    attempt, _ = hedging._hedged_get(upstream, send)
+    upstream.release(attempt, True)
+    assert len(calls) == 1
+
+
+def test_hedge_retries_connection_error_on_other_replica(hedging):
+    upstream = pool('http://a http://b', breaker_failures=100)
+    calls = []
+
+    def send(replica):
+        calls.append(replica)
+        if len(calls) == 1:
+            raise requests.ConnectionError('refused')
+        return FakeResponse(replica.base_url)
+
+    attempt, _ = hedging._hedged_get(upstream, send)
+    upstream.release(attempt, True)
+    assert calls[0] is not calls[1] and attempt.replica is calls[1]
+    assert calls[0].errors == 1
@@ -0,0 +1,227 @@
+"""Client-side load balancing across upstream replicas.
+
+Each upstream is a list of replica base URLs. A request goes to the replica
+with the fewest outstanding requests, either across all healthy replicas
+('least') or between two picked at random ('p2c', power of two choices).
+Health is tracked passively: eject_failures consecutive connection errors or
+5xx responses eject a replica for eject_seconds, after which it is
+re-admitted on probation; one more failure ejects it again, a success
+clears it. If every replica is ejected, the one due back soonest is used
+rather than failing the request outright.
+
+Each pool also guards the upstream as a whole. A circuit breaker opens after
+breaker_failures consecutive failures and rejects requests for
+breaker_open_seconds, then lets a single trial request through (half-open)
+to decide whether to close again. Only the trial, and requests admitted
+since the breaker last opened, move the breaker; outcomes of requests
+admitted before it opened are ignored. At most max_concurrency requests may
+be in flight; beyond that acquire() fails immediately instead of queueing. Both
+rejections raise Unavailable. Response latencies are kept in a rolling
+window so callers can derive a hedging delay from their p95.
+"""
+import math
+import random
+import threading
+import time
+from collections import deque
+
+
+class Unavailable(Exception):
+    """The upstream refused the request locally (circuit open or saturated)."""
+
+    def __init__(self, upstream, reason, retry_after=1):
+        super().__init__(f'{upstream} {reason}')
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+class Replica:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def url(self, subpath=None):
+        return self.base_url if not subpath else f"{self.base_url}/{subpath}"
+
+
+class Attempt:
+    """One admitted request: the replica it goes to and the breaker state it was admitted under."""
+    __slots__ = ('replica', 'generation', 'trial')
+
+    def __init__(self, replica, generation, trial):
+        self.replica = replica
+        self.generation = generation
+        self.trial = trial
+
+
+class UpstreamPool:
+    def __init__(self, name, urls, strategy='p2c', eject_failures=3, eject_seconds=10.0,
+                 breaker_failures=5, breaker_open_seconds=10.0, max_concurrency=0,
+                 latency_window=256, hedge_min_samples=20, hedge_min_delay=0.05):
+        if isinstance(urls, str):
+            urls = urls.replace(',', ' ').split()
+        if not urls:
+            raise ValueError(f'{name}: no upstream URLs configured')
+        self.name = name
+        self.replicas = [Replica(u) for u in urls]
+        if strategy not in ('least', 'p2c'):
+            raise ValueError(f'{name}: unknown balancing strategy {strategy!r}')
+        self.strategy = strategy
+        self.eject_failures = max(int(eject_failures), 1)
+        self.eject_seconds = float(eject_seconds)
+        self.breaker_failures = max(int(breaker_failures), 1)
+        self.breaker_open_seconds = float(breaker_open_seconds)
+        # 0 disables the limit
+        self.max_concurrency = int(max_concurrency)
+        self.hedge_min_samples = int(hedge_min_samples)
+        self.hedge_min_delay = float(hedge_min_delay)
+        self._latencies = deque(maxlen=int(latency_window))
+        self._in_flight = 0
+        self._breaker = 'closed'
+        self._breaker_failures = 0
+        self._opened_until = 0.0
+        self._trials = 0
+        # Bumped each time the breaker opens; attempts from older generations don't count
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'rejectedOpen': 0, 'rejectedSaturated': 0, 'breakerOpens': 0}
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def _admit(self, now):
+        # Called with the lock held; returns whether this is the half-open trial
+        if self.max_concurrency and self._in_flight >= self.max_concurrency:
+            self._stats['rejectedSaturated'] += 1
+            raise Unavailable(self.name, 'saturated')
+        if self._breaker == 'open':
+            if now < self._opened_until:
+                self._stats['rejectedOpen'] += 1
+                raise Unavailable(self.name, 'circuit open', self._opened_until - now)
+            self._breaker = 'half_open'
+        trial = False
+        if self._breaker == 'half_open':
+            if self._trials:
+                self._stats['rejectedOpen'] += 1
+                raise Unavailable(self.name, 'circuit half-open')
+            self._trials += 1
+            trial = True
+        self._in_flight += 1
+        return trial
+
+    def _open(self):
+        self._breaker = 'open'
+        self._generation += 1
+        self._opened_until = time.monotonic() + self.breaker_open_seconds
+        self._stats['breakerOpens'] += 1
+        print(f"{self.name}: circuit open for {self.breaker_open_seconds}s after {self._breaker_failures} failures")
+
+    def _record(self, attempt, ok):
+        # Called with the lock held; ok=None is a neutral outcome (abandoned hedge)
+        if attempt.trial:
+            self._trials -= 1
+        if attempt.generation != self._generation:
+            # Admitted before the breaker last opened: too late to say anything about it now
+            return
+        if ok is None:
+            # Neutral; an abandoned trial just frees the slot for the next one
+            return
+        if attempt.trial:
+            if ok:
+                self._breaker = 'closed'
+                self._breaker_failures = 0
+            else:
+                self._breaker_failures += 1
+                self._open()
+            return
+        if self._breaker != 'closed':
+            return
+        if ok:
+            self._breaker_failures = 0
+            return
+        self._breaker_failures += 1
+        if self._breaker_failures >= self.breaker_failures:
+            self._open()
+
+    def acquire(self, exclude=()):
+        """Admit a request and pick a replica for it. Returns an Attempt to pass
+        to release(). Raises Unavailable when the circuit is open or the
+        upstream is saturated.
+        """
+        now = time.monotonic()
+        with self._lock:
+            trial = self._admit(now)
+            candidates = [r for r in self.replicas if r not in exclude] or self.replicas
+            healthy = [r for r in candidates if r.ejected_until <= now]
+            # Shuffle so ties on outstanding count don't always favour the first replica
+            random.shuffle(healthy)
+            if not healthy:
+                replica = min(candidates, key=lambda r: r.ejected_until)
+            elif self.strategy == 'p2c' and len(healthy) > 2:
+                a, b = random.sample(healthy, 2)
+                replica = a if a.outstanding <= b.outstanding else b
+            else:
+                replica = min(healthy, key=lambda r: r.outstanding)
+            replica.outstanding += 1
+            replica.requests += 1
+            return Attempt(replica, self._generation, trial)
+
+    def release(self, attempt, ok):
+        """Finish an attempt: ok is True/False for success/failure, None to stay neutral."""
+        replica = attempt.replica
+        with self._lock:
+            replica.outstanding -= 1
+            self._in_flight -= 1
+            self._record(attempt, ok)
+            if ok is None:
+                return
+            if ok:
+                replica.failures = 0
+                return
+            replica.errors += 1
+            replica.failures += 1
+            if replica.failures >= self.eject_failures:
+                replica.ejected_until = time.monotonic() + self.eject_seconds
+                replica.ejections += 1
+                print(f"{self.name}: ejecting {replica.base_url} for {self.eject_seconds}s after {replica.failures} failures")
+
+    def observe(self, seconds):
+        """Record the time to response headers of a successful request."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self):
+        """p95 of recent latencies (at least hedge_min_delay), or None until warmed up."""
+        with self._lock:
+            if len(self._latencies) < max(self.hedge_min_samples, 1):
+                return None
+            samples = sorted(self._latencies)
+        return max(samples[int(0.95 * (len(samples) - 1))], self.hedge_min_delay)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            replicas = [{
+                'url': r.base_url,
+                'healthy': r.ejected_until <= now,
+                'outstanding': r.outstanding,
+                'requests': r.requests,
+                'errors': r.errors,
+                'ejections': r.ejections,
+            } for r in self.replicas]
+            out = dict(self._stats)
+            out.update({
+                'breaker': 'half_open' if self._breaker == 'open' and now >= self._opened_until else self._breaker,
+                'inFlight': self._in_flight,
+                'maxConcurrency': self.max_concurrency,
+            })
+        delay = self.hedge_delay()
+        out['hedgeDelayMs'] = round(delay * 1000.0, 1) if delay is not None else None
+        out['replicas'] = replicas
+        return out
@@ -0,0 +1,163 @@
+"""Verified-token cache shared by the auth decorators.
+
+A bearer JWT is HS256-verified once per process and its claims cached under
+the token's SHA-256 digest until the token's `exp` (capped at max_ttl), in an
+LRU bounded to max_entries. Tokens that fail verification are not cached.
+
+When IDENTITY_SECRET is set the gateway can verify the JWT at the edge and
+pass the caller's claims downstream as a signed X-Identity assertion
+(base64url JSON claims + HMAC-SHA256). Services sharing the secret accept
+that header in place of the JWT; it is cached the same way. Internal calls
+forward it, so one client request verifies its token once per hop at most.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+IDENTITY_HEADER = 'X-Identity'
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_identity(claims, secret):
+    payload = _b64encode(json.dumps(claims, separators=(',', ':'), sort_keys=True, default=str).encode('utf-8'))
+    sig = hmac.new(secret.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(sig)}"
+
+
+def verify_identity(assertion, secret):
+    """Claims of a sign_identity() assertion; raises ValueError if forged or expired."""
+    payload, _, sig = assertion.partition('.')
+    expected = hmac.new(secret.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+    try:
+        valid = hmac.compare_digest(_b64decode(sig), expected)
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ValueError('bad identity signature')
+    claims = json.loads(_b64decode(payload))
+    if claims.get('exp') is not None and float(claims['exp']) <= time.time():
+        raise ValueError('identity expired')
+    return claims
+
+
+class TokenCache:
+    def __init__(self, verify, max_entries=10000, max_ttl=300.0):
+        self._verify = verify
+        self.max_entries = max(int(max_entries), 1)
+        self.max_ttl = float(max_ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'rejected': 0, 'evictions': 0}
+
+    def get(self, token):
+        """Verified claims for `token`, or None if it does not verify."""
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self._stats['misses'] += 1
+        try:
+            claims = self._verify(token)
+        except Exception:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return None
+        expires_at = now + self.max_ttl
+        if claims.get('exp') is not None:
+            expires_at = min(float(claims['exp']), expires_at)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return claims
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['entries'] = len(self._entries)
+        return out
+
+
+class Authenticator:
+    def __init__(self, jwt_secret, jwt_alg, identity_secret=None, max_entries=10000, max_ttl=300.0):
+        self.jwt_secret = jwt_secret
+        self.jwt_alg = jwt_alg
+        self.identity_secret = identity_secret
+        self.tokens = TokenCache(self._decode, max_entries, max_ttl)
+        self.identities = None
+        self.assertions = None
+        if identity_secret:
+            self.identities = TokenCache(lambda a: verify_identity(a, identity_secret), max_entries, max_ttl)
+            self.assertions = TokenCache(self._mint, max_entries, max_ttl)
+
+    def _decode(self, token):
+        return jwt.decode(token, self.jwt_secret, algorithms=[self.jwt_alg])
+
+    def _mint(self, token):
+        claims = self._decode(token)
+        return {'exp': claims.get('exp'), 'assertion': sign_identity(claims, self.identity_secret)}
+
+    @staticmethod
+    def bearer(headers):
+        auth = headers.get('Authorization') or ''
+        if not auth.startswith('Bearer '):
+            return None
+        return auth.split(' ', 1)[1].strip()
+
+    def claims(self, headers):
+        """Claims of the caller: a trusted X-Identity assertion if present, else the bearer JWT."""
+        if self.identities is not None:
+            assertion = headers.get(IDENTITY_HEADER)
+            if assertion:
+                return self.identities.get(assertion)
+        token = self.bearer(headers)
+        if not token:
+            return None
+        return self.tokens.get(token)
+
+    def edge_verify(self, token):
+        """Gateway check of a bearer token: None if it does not verify, else its
+        signed identity assertion ('' when no IDENTITY_SECRET is configured).
+        """
+        if self.assertions is None:
+            return '' if self.tokens.get(token) is not None else None
+        minted = self.assertions.get(token)
+        return minted['assertion'] if minted else None
+
+    def stats(self):
+        out = {'tokens': self.tokens.stats()}
+        if self.identities is not None:
+            out['identities'] = self.identities.stats()
+            out['assertions'] = self.assertions.stats()
+        return out
+
+
+def authenticator_from_env(jwt_secret, jwt_alg):
+    return Authenticator(
+        jwt_secret,
+        jwt_alg,
+        identity_secret=os.environ.get('IDENTITY_SECRET') or None,
+        max_entries=int(os.environ.get('AUTH_CACHE_SIZE', '10000')),
+        max_ttl=float(os.environ.get('AUTH_CACHE_MAX_TTL', '300')),
+    )
@@ -0,0 +1,200 @@
+"""Bounded MySQL connection pool used by the request handlers.
+
+Connections are opened lazily up to DB_POOL_SIZE, pinged on checkout and
+handed back to the pool when the borrower calls close(). Anything a handler
+forgets to close is returned at app-context teardown, so a connection never
+outlives the request that borrowed it.
+"""
+import os
+import queue
+import threading
+import time
+
+import mysql.connector
+from flask import g, has_app_context
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout."""
+
+
+class PooledConnection:
+    """Proxy around a raw connection; close() returns it to the pool."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        self._pool._release(self._raw)
+
+    def execute_prepared(self, sql, params=()):
+        """Run `sql` as a server-side prepared statement. The statement is prepared
+        once per underlying connection and reused by every later borrower. Returns
+        the statement's cursor, which belongs to the connection: do not close it.
+        """
+        statements = getattr(self._raw, '_pool_statements', None)
+        if statements is None:
+            statements = self._raw._pool_statements = {}
+        entry = statements.get(sql)
+        if entry is None:
+            # The cursor re-prepares whenever it is given a different string object,
+            # so keep the first one and always execute with it
+            entry = statements[sql] = (sql, self._raw.cursor(prepared=True))
+        text, cursor = entry
+        cursor.execute(text, params)
+        return cursor
+
+
+class ConnectionPool:
+    def __init__(self, size=10, timeout=5.0, ping_interval=0.0, **connect_kwargs):
+        self.size = max(int(size), 1)
+        self.timeout = float(timeout)
+        # Skip the checkout ping if the connection was used this recently (seconds)
+        self.ping_interval = float(ping_interval)
+        self._connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'discarded': 0,
+            'waitMsTotal': 0.0,
+            'waitMsMax': 0.0,
+        }
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self._connect_kwargs)
+        with self._lock:
+            self._stats['connects'] += 1
+        return raw
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+            self._stats['discarded'] += 1
+
+    def _alive(self, raw, last_used):
+        if self.ping_interval and time.monotonic() - last_used < self.ping_interval:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Borrow a live connection, waiting up to `timeout` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            raw = None
+            try:
+                raw, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        raw = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    last_used = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._lock:
+                            self._stats['timeouts'] += 1
+                        raise PoolTimeout(f'no DB connection available within {self.timeout}s (pool size {self.size})')
+                    with self._lock:
+                        self._waiting += 1
+                    try:
+                        raw, last_used = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+                    finally:
+                        with self._lock:
+                            self._waiting -= 1
+            if last_used is not None and not self._alive(raw, last_used):
+                self._discard(raw)
+                continue
+            waited_ms = (time.monotonic() - started) * 1000.0
+            with self._lock:
+                self._in_use += 1
+                self._stats['checkouts'] += 1
+                self._stats['waitMsTotal'] += waited_ms
+                self._stats['waitMsMax'] = max(self._stats['waitMsMax'], waited_ms)
+            return PooledConnection(self, raw)
+
+    def _release(self, raw):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            # End any implicit transaction so the next borrower gets a fresh snapshot
+            raw.rollback()
+        except Exception:
+            self._discard(raw)
+            return
+        self._idle.put((raw, time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({
+                'size': self.size,
+                'open': self._created,
+                'inUse': self._in_use,
+                'idle': self._idle.qsize(),
+                'waiting': self._waiting,
+            })
+        out['waitMsTotal'] = round(out['waitMsTotal'], 3)
+        out['waitMsMax'] = round(out['waitMsMax'], 3)
+        out['saturation'] = round(out['inUse'] / out['size'], 3)
+        return out
+
+
+def pool_from_env(default_db, **connect_kwargs):
+    return ConnectionPool(
+        size=int(os.environ.get('DB_POOL_SIZE', '10')),
+        timeout=float(os.environ.get('DB_POOL_TIMEOUT', '5')),
+        ping_interval=float(os.environ.get('DB_POOL_PING_INTERVAL', '0')),
+        host=os.environ.get('DB_HOST', 'localhost'),
+        user=os.environ.get('DB_USER', 'user'),
+        password=os.environ.get('DB_PASSWORD', 'password'),
+        database=os.environ.get('DB_NAME', default_db),
+        **connect_kwargs,
+    )
+
+
+def borrow(pool):
+    """Check out a connection, tracking it on the current app context if any."""
+    conn = pool.acquire()
+    if has_app_context():
+        g.setdefault('_db_conns', []).append(conn)
+    return conn
+
+
+def init_app(app):
+    @app.teardown_appcontext
+    def _return_db_connections(exc):
+        for conn in g.pop('_db_conns', []):
+            conn.close()
@@ -0,0 +1,143 @@
+"""sqlite-backed stand-in for mysql-connector connections, used by the service tests.
+
+Database(path, schema) hands out Connection objects over one sqlite file, so
+each connection has its own transaction as with MySQL. They translate the
+MySQL the services send (%s placeholders, INSERT IGNORE, UTC_TIMESTAMP() and
+`+ INTERVAL %s SECOND`) and emulate the row locks the background workers rely
+on: rows returned by `SELECT ... LIMIT %s FOR UPDATE SKIP LOCKED` stay locked,
+keyed by their first column, until the connection commits, rolls back or
+closes, and other connections' SKIP LOCKED selects pass over them. A plain
+FOR UPDATE takes no lock and never waits.
+
+Test-only: not copied into the service images.
+"""
+import re
+import sqlite3
+import threading
+
+_TRANSLATIONS = (
+    ('%s', '?'),
+    ('INSERT IGNORE', 'INSERT OR IGNORE'),
+    ('UTC_TIMESTAMP() + INTERVAL ? SECOND', "datetime('now', '+' || ? || ' seconds')"),
+    ('UTC_TIMESTAMP()', "datetime('now')"),
+)
+_SKIP_LOCKED = re.compile(r'\s+LIMIT %s\s+FOR UPDATE SKIP LOCKED\s*$')
+_TABLE = re.compile(r'\bFROM (\w+)')
+
+
+def translate(sql):
+    for mysql, sqlite in _TRANSLATIONS:
+        sql = sql.replace(mysql, sqlite)
+    return sql.replace(' FOR UPDATE', '')
+
+
+class Database:
+    def __init__(self, path, schema=''):
+        self.path = str(path)
+        self._locks = {}
+        self._mutex = threading.Lock()
+        if schema:
+            db = sqlite3.connect(self.path)
+            db.executescript(schema)
+            db.close()
+
+    def connect(self):
+        return Connection(self)
+
+    def execute(self, sql, params=()):
+        """Run one statement outside the test connections, commit, and return its rows."""
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            rows = db.execute(translate(sql), params).fetchall()
+            db.commit()
+            return rows
+        finally:
+            db.close()
+
+    def _claim(self, conn, table, rows, limit):
+        # Lock up to `limit` rows not held by another connection
+        claimed = []
+        with self._mutex:
+            for row in rows:
+                if len(claimed) >= limit:
+                    break
+                if self._locks.setdefault((table, row[0]), conn) is conn:
+                    claimed.append(row)
+        return claimed
+
+    def _unlock(self, conn):
+        with self._mutex:
+            for key in [k for k, holder in self._locks.items() if holder is conn]:
+                del self._locks[key]
+
+
+class Cursor:
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cur = conn.raw.cursor()
+        self._dictionary = dictionary
+        self._claimed = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        params = tuple(params)
+        locking = _SKIP_LOCKED.search(sql)
+        self._claimed = None
+        if locking:
+            sql, limit, params = sql[:locking.start()], params[-1], params[:-1]
+        self._cur.execute(translate(sql), params)
+        self.rowcount = self._cur.rowcount
+        self.lastrowid = self._cur.lastrowid
+        if locking:
+            table = _TABLE.search(sql).group(1)
+            self._claimed = iter(self._conn.database._claim(self._conn, table, self._cur.fetchall(), limit))
+
+    def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.execute(sql, params)
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        row = next(self._claimed, None) if self._claimed is not None else self._cur.fetchone()
+        return self._row(row)
+
+    def fetchall(self):
+        rows = list(self._claimed) if self._claimed is not None else self._cur.fetchall()
+        return [self._row(r) for r in rows]
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, database):
+        self.database = database
+        self.raw = sqlite3.connect(database.path, timeout=10, check_same_thread=False)
+        self.closed = False
+
+    def cursor(self, dictionary=False, **kwargs):
+        return Cursor(self, dictionary)
+
+    def execute_prepared(self, sql, params=()):
+        cur = Cursor(self)
+        cur.execute(sql, params)
+        return cur
+
+    def commit(self):
+        self.raw.commit()
+        self.database._unlock(self)
+
+    def rollback(self):
+        self.raw.rollback()
+        self.database._unlock(self)
+
+    def close(self):
+        if not self.closed:
+            self.rollback()
+            self.raw.close()
+            self.closed = True
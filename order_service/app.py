@@ -1,11 +1,23 @@
 import os
+import time
 import uuid
 import json
+import base64
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import requests
 import jwt
-import boto3
 import mysql.connector
-from flask import Flask, request, jsonify
+from mysql.connector import errorcode
+import auth_cache
+import db_pool
+import events
+import stock_release
+from flask import Flask, Response, request, jsonify, after_this_request
+from werkzeug.http import quote_etag
 import coverage as _coverage
 
 app = Flask(__name__)
@@ -15,28 +27,15 @@ PRODUCT_SERVICE_URL = os.environ.get('PRODUCT_SERVICE_URL', 'http://localhost:80
 JWT_SECRET = os.environ.get('JWT_SECRET', 'dev-secret-change-me')
 JWT_ALG = 'HS256'
 
-SQS_QUEUE_URL = os.environ.get('SQS_QUEUE_URL')
-# Always honor explicit endpoint when provided (e.g., LocalStack: http://localstack:4566)
-# For SQS, SendMessage talks to the service endpoint and passes QueueUrl as a parameter,
-# so we must set endpoint_url to hit LocalStack instead of real AWS.
-endpoint_url = os.environ.get('AWS_ENDPOINT') or os.environ.get('AWS_ENDPOINT_URL')
-sqs = boto3.client(
-    'sqs',
-    region_name=os.environ.get('AWS_REGION', 'us-east-1'),
-    endpoint_url=endpoint_url
-)
+sqs = events.sqs_client_from_env()
 from functools import wraps
 
+# Verified tokens are cached per process until they expire
+authenticator = auth_cache.authenticator_from_env(JWT_SECRET, JWT_ALG)
+
+
 def _auth_ok():
-    auth = request.headers.get('Authorization') or ''
-    if not auth.startswith('Bearer '):
-        return False
-    token = auth.split(' ', 1)[1].strip()
-    try:
-        jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return True
-    except Exception:
-        return False
+    return authenticator.claims(request.headers) is not None
 
 def require_auth(fn):
     @wraps(fn)
@@ -48,24 +47,103 @@ def require_auth(fn):
 
 
 def _fwd_auth_headers():
-    auth = request.headers.get('Authorization')
-    return {'Authorization': auth} if auth else {}
+    headers = {}
+    for h in ('Authorization', auth_cache.IDENTITY_HEADER):
+        v = request.headers.get(h)
+        if v:
+            headers[h] = v
+    return headers
+
+
+# Pooled connections: close() hands the connection back instead of disconnecting
+conn_pool = db_pool.pool_from_env('order_db')
+db_pool.init_app(app)
 
 
 def get_db_connection():
     try:
-        conn = mysql.connector.connect(
-            host=os.environ.get('DB_HOST', 'localhost'),
-            user=os.environ.get('DB_USER', 'user'),
-            password=os.environ.get('DB_PASSWORD', 'password'),
-            database=os.environ.get('DB_NAME', 'order_db')
-        )
-        return conn
-    except mysql.connector.Error as err:
+        return db_pool.borrow(conn_pool)
+    except (mysql.connector.Error, db_pool.PoolTimeout) as err:
         print(f"Error: {err}")
         return None
 
 
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'dbPool': conn_pool.stats(), 'auth': authenticator.stats(), 'outbox': relay.stats(), 'stockReleases': releaser.stats()}), 200
+
+
+# Must not exceed product-service's MAX_BATCH_IDS
+PRODUCT_BATCH_SIZE = int(os.environ.get('PRODUCT_BATCH_SIZE', '100'))
+
+
+def _product_chunks(product_ids):
+    ids = list(dict.fromkeys(product_ids))
+    return [ids[i:i + PRODUCT_BATCH_SIZE] for i in range(0, len(ids), PRODUCT_BATCH_SIZE)]
+
+
+def _fetch_product_chunk(ids, headers, timeout=None):
+    resp = requests.get(
+        f"{PRODUCT_SERVICE_URL}/products",
+        params={'ids': ','.join(ids)},
+        headers=headers,
+        timeout=timeout
+    )
+    resp.raise_for_status()
+    return {p['id']: p for p in resp.json()}
+
+
+def _fetch_products(product_ids, headers, timeout=None):
+    """Fetch products by ID with one batch call per PRODUCT_BATCH_SIZE ids.
+    Returns {product_id: product}; unknown ids are absent. Raises
+    requests.exceptions.RequestException on transport or upstream errors.
+    """
+    products = {}
+    for chunk in _product_chunks(product_ids):
+        products.update(_fetch_product_chunk(chunk, headers, timeout))
+    return products
+
+
+# Concurrent upstream calls: create_order validation and order-details enrichment
+UPSTREAM_WORKERS = int(os.environ.get('UPSTREAM_WORKERS', '16'))
+VALIDATION_DEADLINE_SECONDS = float(os.environ.get('VALIDATION_DEADLINE_SECONDS', '5'))
+ENRICH_DEADLINE_SECONDS = float(os.environ.get('ENRICH_DEADLINE_SECONDS', '5'))
+_upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix='upstream')
+
+
+def _remaining(deadline):
+    return max(deadline - time.monotonic(), 0.001)
+
+
+def _get_json(url, headers, deadline):
+    resp = requests.get(url, headers=headers, timeout=_remaining(deadline))
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _collect(futures, deadline):
+    """Wait for {field: future} until the deadline.
+    Returns ({field: result}, {field: error}); slow calls are cancelled and
+    reported as 'timeout' rather than failing the whole response.
+    """
+    done, _ = wait(futures.values(), timeout=_remaining(deadline))
+    results, errors = {}, {}
+    for field, fut in futures.items():
+        if fut not in done:
+            fut.cancel()
+            errors[field] = 'timeout'
+            continue
+        try:
+            results[field] = fut.result()
+        except requests.exceptions.HTTPError as e:
+            errors[field] = f'upstream status {e.response.status_code}'
+        except requests.exceptions.Timeout:
+            errors[field] = 'timeout'
+        except Exception:
+            errors[field] = 'unavailable'
+    return results, errors
+
+
 def _validate_items(items):
     if not isinstance(items, list) or len(items) == 0:
         return False, 'items must be a non-empty array'
@@ -74,6 +152,8 @@ def _validate_items(items):
             return False, 'Each item must be an object'
         if 'productId' not in it or 'quantity' not in it:
             return False, 'Each item requires productId and quantity'
+        if not isinstance(it['productId'], str) or not it['productId']:
+            return False, 'productId must be a non-empty string'
         try:
             qty = int(it['quantity'])
             if qty <= 0:
@@ -83,12 +163,214 @@ def _validate_items(items):
     return True, None
 
 
-def _emit_event(event_type, payload):
+# In-process outbox relay; more can run as separate `python outbox_relay.py` processes
+relay = events.relay_from_env(get_db_connection, sqs)
+OUTBOX_RELAY_IN_PROCESS = os.environ.get('OUTBOX_RELAY_IN_PROCESS', '1').lower() in ('1', 'true', 'yes')
+
+
+def _wake_relay(response):
+    relay.wake()
+    return response
+
+
+# (token, exp), replaced as a whole so request and upstream-pool threads never see a torn pair
+_service_token = (None, 0)
+
+
+def _service_auth_headers():
+    """Short-lived token for calls order_service makes on its own behalf.
+    Reused until a minute before expiry so downstream token caches hit.
+    """
+    global _service_token
+    now = int(time.time())
+    token, exp = _service_token
+    if exp - 60 <= now:
+        token, exp = jwt.encode({'sub': 'order_service', 'iat': now, 'exp': now + 300}, JWT_SECRET, algorithm=JWT_ALG), now + 300
+        _service_token = (token, exp)
+    return {'Authorization': f"Bearer {token}"}
+
+
+# Stock for cancelled orders is released by a background worker, not under the order lock
+releaser = stock_release.releaser_from_env(get_db_connection, PRODUCT_SERVICE_URL, _service_auth_headers)
+STOCK_RELEASER_IN_PROCESS = os.environ.get('STOCK_RELEASER_IN_PROCESS', '1').lower() in ('1', 'true', 'yes')
+
+
+def _wake_releaser(response):
+    releaser.wake()
+    return response
+
+
+def _emit_event(cursor, event_type, payload):
+    """Write the event to the outbox in the caller's transaction (call before commit)."""
+    body = json.dumps({'eventType': event_type, **payload}, default=str)
+    events.write_outbox(cursor, event_type, body)
+    if OUTBOX_RELAY_IN_PROCESS:
+        # Runs after the view has committed and returned
+        after_this_request(_wake_relay)
+
+
+# Idempotency-Key fast path: recent keys are answered from memory, older ones from
+# the uq_orders_idmp index; keys being processed are tracked so retries wait.
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '15'))
+_idmp_lock = threading.Lock()
+_idmp_cache = OrderedDict()
+_idmp_inflight = {}
+
+
+def _idmp_remember(key, body):
+    with _idmp_lock:
+        _idmp_cache[key] = body
+        _idmp_cache.move_to_end(key)
+        while len(_idmp_cache) > IDEMPOTENCY_CACHE_SIZE:
+            _idmp_cache.popitem(last=False)
+
+
+def _idmp_lookup(key):
+    """Return the original 201 body for a key already used, else None."""
+    with _idmp_lock:
+        body = _idmp_cache.get(key)
+        if body:
+            _idmp_cache.move_to_end(key)
+            return body
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT id FROM orders WHERE idempotency_key=%s", (key,))
+        row = cur.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    body = {'id': row['id'], 'status': 'PENDING'}
+    _idmp_remember(key, body)
+    return body
+
+
+def _idmp_claim(key):
+    """Return the stored response to replay, or None once this request owns the key.
+    Raises ValidationFailed(409) if another request keeps the key busy too long.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        body = _idmp_lookup(key)
+        if body:
+            return body
+        with _idmp_lock:
+            event = _idmp_inflight.get(key)
+            if event is None:
+                _idmp_inflight[key] = threading.Event()
+                return None
+        if time.monotonic() >= deadline or not event.wait(_remaining(deadline)):
+            raise ValidationFailed(409, 'A request with this Idempotency-Key is still in progress')
+
+
+def _idmp_release(key):
+    with _idmp_lock:
+        event = _idmp_inflight.pop(key, None)
+    if event:
+        event.set()
+
+
+class ValidationFailed(Exception):
+    """A create_order dependency check failed; carries the HTTP response."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _check_user(user_id, headers, deadline):
     try:
-        body = { 'eventType': event_type, **payload }
-        sqs.send_message(QueueUrl=SQS_QUEUE_URL, MessageBody=json.dumps(body))
-    except Exception as e:
-        print(f"Failed to send SQS message: {e}")
+        r = requests.get(f"{USER_SERVICE_URL}/users/{user_id}", headers=headers, timeout=_remaining(deadline))
+    except requests.exceptions.RequestException as e:
+        raise ValidationFailed(503, f'Could not connect to User Service: {e}')
+    if r.status_code != 200:
+        raise ValidationFailed(400, 'Invalid user ID')
+    try:
+        return r.json()
+    except requests.JSONDecodeError as e:
+        raise ValidationFailed(503, f'Invalid response from User Service: {e}')
+
+
+def _resolve_address(user_id, shipping_address_id, headers, deadline):
+    """Validate the given address belongs to the user, or pick their default."""
+    try:
+        r = requests.get(f"{USER_SERVICE_URL}/users/{user_id}/addresses", headers=headers, timeout=_remaining(deadline))
+        arr = r.json() if r.status_code == 200 else None
+    except Exception:
+        arr = None
+    if not shipping_address_id:
+        # Best-effort default; the order is still valid without an address
+        if isinstance(arr, list) and len(arr) > 0:
+            return arr[0].get('id')
+        return None
+    if arr is None:
+        raise ValidationFailed(400, 'Failed to validate shippingAddressId')
+    ids = {a.get('id') for a in arr if isinstance(a, dict)}
+    if shipping_address_id not in ids:
+        raise ValidationFailed(400, 'shippingAddressId does not belong to user')
+    return shipping_address_id
+
+
+def _check_products(items, headers, deadline):
+    """Price the items and check stock. Sets item['price'] and returns
+    (total_amount, {product_id: total requested quantity}).
+    """
+    try:
+        products = _fetch_products([item['productId'] for item in items], headers, timeout=_remaining(deadline))
+    except requests.JSONDecodeError as e:
+        raise ValidationFailed(503, f'Invalid response from Product Service: {e}')
+    except requests.exceptions.RequestException as e:
+        raise ValidationFailed(503, f'Could not connect to Product Service: {e}')
+    except (KeyError, TypeError) as e:
+        raise ValidationFailed(503, f'Invalid response from Product Service: {e!r}')
+    total_amount = 0
+    requested = {}
+    for item in items:
+        product_id = item['productId']
+        product_data = products.get(product_id)
+        if product_data is None:
+            raise ValidationFailed(400, f'Product with ID {product_id} not found')
+        try:
+            stock, price = int(product_data['stock']), float(product_data['price'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValidationFailed(503, f'Invalid response from Product Service for {product_id}: {e!r}')
+        # Repeated lines for the same product draw on the same stock
+        requested[product_id] = requested.get(product_id, 0) + int(item['quantity'])
+        if stock < requested[product_id]:
+            raise ValidationFailed(400, f"Not enough stock for product {product_data.get('name', product_id)}")
+        item['price'] = price
+        total_amount += item['price'] * item['quantity']
+    return total_amount, requested
+
+
+def _run_checks(checks, deadline):
+    """Run {name: (fn, *args)} concurrently and return {name: result}.
+    The first failure cancels whatever has not started yet and is re-raised;
+    missing the deadline raises ValidationFailed(504).
+    """
+    futures = {_upstream_pool.submit(fn, *args): name for name, (fn, *args) in checks.items()}
+    results = {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            for fut in pending:
+                fut.cancel()
+            names = ', '.join(sorted(futures[f] for f in pending))
+            raise ValidationFailed(504, f'Timed out validating {names}')
+        for fut in done:
+            try:
+                results[futures[fut]] = fut.result()
+            except Exception:
+                for other in pending:
+                    other.cancel()
+                raise
+    return results
 
 
 @app.route('/api/v1/orders', methods=['POST'])
@@ -98,85 +380,119 @@ def create_order():
     if not data or not all(k in data for k in ('userId', 'items')):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    user_id = data['userId']
-    items = data['items']
-    # New model: store only shippingAddressId; details are fetched from user-service on read.
-    shipping_address_id = data.get('shippingAddressId')
     idmp_key = request.headers.get('Idempotency-Key')
+    if idmp_key is not None and not 0 < len(idmp_key) <= 64:
+        return jsonify({'error': 'Idempotency-Key must be 1-64 characters'}), 400
 
-    ok, err = _validate_items(items)
+    ok, err = _validate_items(data['items'])
     if not ok:
         return jsonify({'error': err}), 400
 
+    if not idmp_key:
+        return _place_order(data, None)
+    # Known key: replay before any upstream work; concurrent retries wait on the first
     try:
-        user_response = requests.get(f"{USER_SERVICE_URL}/users/{user_id}", headers=_fwd_auth_headers())
-        if user_response.status_code != 200:
-            return jsonify({'error': 'Invalid user ID'}), 400
-        user_json = user_response.json()
-    except requests.exceptions.RequestException as e:
-        return jsonify({'error': f'Could not connect to User Service: {e}'}), 503
+        replay = _idmp_claim(idmp_key)
+    except ValidationFailed as e:
+        return jsonify({'error': e.message}), e.status
+    if replay:
+        return jsonify(replay), 201
+    try:
+        return _place_order(data, idmp_key)
+    finally:
+        _idmp_release(idmp_key)
 
-    # Resolve shipping_address_id: either validate provided ID or pick default
-    def _pick_default_address_id(uid):
-        try:
-            r = requests.get(f"{USER_SERVICE_URL}/users/{uid}/addresses", headers=_fwd_auth_headers(), timeout=5)
-            if r.status_code == 200:
-                arr = r.json()
-                if isinstance(arr, list) and len(arr) > 0:
-                    return arr[0].get('id')
-        except Exception:
-            return None
-        return None
 
-    if shipping_address_id:
-        # Validate it belongs to the user
+def _queue_release(conn, order_id, reserved):
+    cur = conn.cursor()
+    try:
+        stock_release.enqueue_release(cur, order_id, reserved)
+        conn.commit()
+    except mysql.connector.Error as err:
+        print(f"Could not queue the stock release for order {order_id}: {err}")
         try:
-            r = requests.get(f"{USER_SERVICE_URL}/users/{user_id}/addresses", headers=_fwd_auth_headers(), timeout=5)
-            if r.status_code == 200:
-                ids = {a.get('id') for a in r.json() if isinstance(a, dict)}
-                if shipping_address_id not in ids:
-                    return jsonify({'error': 'shippingAddressId does not belong to user'}), 400
-            else:
-                return jsonify({'error': 'Failed to validate shippingAddressId'}), 400
-        except Exception:
-            return jsonify({'error': 'Failed to validate shippingAddressId'}), 400
-    else:
-        shipping_address_id = _pick_default_address_id(user_id)
+            conn.rollback()
+        except mysql.connector.Error:
+            pass
+        return False
+    finally:
+        cur.close()
+    if STOCK_RELEASER_IN_PROCESS:
+        after_this_request(_wake_releaser)
+    return True
 
-    total_amount = 0
-    for item in items:
-        product_id = item['productId']
-        try:
-            product_response = requests.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}", headers=_fwd_auth_headers())
-            if product_response.status_code != 200:
-                return jsonify({'error': f'Product with ID {product_id} not found'}), 400
-            product_data = product_response.json()
-            if product_data['stock'] < item['quantity']:
-                return jsonify({'error': f"Not enough stock for product {product_data['name']}"}), 400
-            item['price'] = float(product_data['price'])
-            total_amount += item['price'] * item['quantity']
-        except requests.exceptions.RequestException as e:
-            return jsonify({'error': f'Could not connect to Product Service: {e}'}), 503
-
-    # Reserve stock for each item
-    reserved = []
-    for item in items:
-        try:
-            resp = requests.post(
-                f"{PRODUCT_SERVICE_URL}/products/{item['productId']}/reserve",
-                json={'quantity': item['quantity']},
-                headers=_fwd_auth_headers()
-            )
-            reserved.append({'productId': item['productId'], 'quantity': item['quantity']})
-        except requests.exceptions.RequestException as e:
-            return jsonify({'error': f'Could not reserve stock: {e}'}), 503
 
+def _release_reserved(order_id, reserved, conn=None):
+    """Give back stock reserved for an order that was not created. It is queued
+    in stock_releases on `conn`, so the background releaser retries it through
+    a product_service outage or a restart. Without a connection it is released
+    directly, and queued on a fresh connection only if that fails.
+    """
+    if conn is not None and _queue_release(conn, order_id, reserved):
+        return
+    try:
+        requests.post(
+            f"{PRODUCT_SERVICE_URL}/products/release",
+            json={'items': reserved},
+            headers=_fwd_auth_headers(),
+            timeout=VALIDATION_DEADLINE_SECONDS
+        ).raise_for_status()
+        return
+    except requests.exceptions.RequestException as e:
+        print(f"Could not release stock reserved for order {order_id}: {e}")
+    if conn is None:
+        conn = get_db_connection()
+        if conn:
+            try:
+                if _queue_release(conn, order_id, reserved):
+                    return
+            finally:
+                conn.close()
+    print(f"Stock reserved for order {order_id} was neither released nor queued: {reserved}")
+
+
+def _place_order(data, idmp_key):
+    user_id = data['userId']
+    items = data['items']
+    # New model: store only shippingAddressId; details are fetched from user-service on read.
+    shipping_address_id = data.get('shippingAddressId')
+
+    # Validation stage: user, shipping address and products are independent checks
+    headers = _fwd_auth_headers()
+    deadline = time.monotonic() + VALIDATION_DEADLINE_SECONDS
+    try:
+        checks = _run_checks({
+            'user': (_check_user, user_id, headers, deadline),
+            'shippingAddress': (_resolve_address, user_id, shipping_address_id, headers, deadline),
+            'products': (_check_products, items, headers, deadline),
+        }, deadline)
+    except ValidationFailed as e:
+        return jsonify({'error': e.message}), e.status
+    shipping_address_id = checks['shippingAddress']
+    total_amount, requested = checks['products']
+
+    # Reserve stock for all items in one all-or-nothing call
+    reserved = [{'productId': pid, 'quantity': qty} for pid, qty in requested.items()]
+    try:
+        resp = requests.post(
+            f"{PRODUCT_SERVICE_URL}/products/reserve",
+            json={'items': reserved},
+            headers=_fwd_auth_headers()
+        )
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': f'Could not reserve stock: {e}'}), 503
+    if resp.status_code == 409:
+        return jsonify({'error': 'Insufficient stock', 'items': resp.json().get('items', [])}), 409
+    if resp.status_code != 200:
+        return jsonify({'error': f'Could not reserve stock: upstream status {resp.status_code}'}), 503
+
+    order_id = str(uuid.uuid4())
     conn = get_db_connection()
     if not conn:
+        _release_reserved(order_id, reserved)
         return jsonify({'error': 'Database connection failed'}), 500
 
     cursor = conn.cursor(dictionary=True)
-    order_id = str(uuid.uuid4())
     try:
         cursor.execute(
             "INSERT INTO orders (id, user_id, status, idempotency_key, total_amount, shipping_address_id) VALUES (%s, %s, %s, %s, %s, %s)",
@@ -187,28 +503,45 @@ def create_order():
             "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (%s, %s, %s, %s)",
             item_params
         )
+        _emit_event(cursor, 'order_created', {
+            'orderId': order_id,
+            'userId': user_id,
+            'totalAmount': total_amount,
+            'items': items
+        })
         conn.commit()
     except mysql.connector.Error as err:
         conn.rollback()
-        # release reserved stock on failure
-        for r in reserved:
-            try:
-                requests.post(f"{PRODUCT_SERVICE_URL}/products/{r['productId']}/release", json={'quantity': r['quantity']})
-            except Exception:
-                pass
+        _release_reserved(order_id, reserved, conn)
+        if idmp_key and err.errno == errorcode.ER_DUP_ENTRY:
+            # Lost the race to another process holding the same key
+            replay = _idmp_lookup(idmp_key)
+            if replay:
+                return jsonify(replay), 201
         return jsonify({'error': f'Failed to create order: {err}'}), 500
     finally:
         cursor.close()
         conn.close()
 
-    _emit_event('order_created', {
-        'orderId': order_id,
-        'userId': user_id,
-        'totalAmount': total_amount,
-        'items': items
-    })
+    body = {'id': order_id, 'status': 'PENDING'}
+    if idmp_key:
+        _idmp_remember(idmp_key, body)
+    return jsonify(body), 201
+
+
+def _encode_cursor(created_at, order_id):
+    raw = json.dumps({'c': created_at.isoformat(), 'i': order_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
 
-    return jsonify({'id': order_id, 'status': 'PENDING'}), 201
+
+def _decode_cursor(cursor):
+    """Inverse of _encode_cursor; returns (created_at, id) or None if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        obj = json.loads(raw)
+        return datetime.datetime.fromisoformat(obj['c']), str(obj['i'])
+    except Exception:
+        return None
 
 
 @app.route('/api/v1/orders', methods=['GET'])
@@ -218,6 +551,7 @@ def list_orders():
     user_id = request.args.get('userId')
     status = request.args.get('status')
     limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    cursor = request.args.get('cursor')
 
     sql = "SELECT id, user_id, status, total_amount, created_at FROM orders"
     params = []
@@ -228,6 +562,14 @@ def list_orders():
     if status:
         where.append("status=%s")
         params.append(status)
+    if cursor:
+        decoded = _decode_cursor(cursor)
+        if not decoded:
+            return jsonify({'error': 'invalid cursor'}), 400
+        # Seek past the last row of the previous page: (created_at DESC, id ASC).
+        # The leading created_at <= %s keeps this a range scan on the index.
+        where.append("created_at <= %s AND (created_at < %s OR id > %s)")
+        params.extend([decoded[0], decoded[0], decoded[1]])
     if where:
         sql += " WHERE " + " AND ".join(where)
     # Keyset pagination using (created_at, id)
@@ -245,6 +587,9 @@ def list_orders():
         conn.close()
 
     next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
 
     return jsonify({'orders': rows, 'nextCursor': next_cursor}), 200
 
@@ -261,12 +606,17 @@ def get_order(order_id):
         order = cur.fetchone()
         if not order:
             return jsonify({'error': 'Not found'}), 404
+        # Items never change after creation, so the order row versions the whole body;
+        # status is hashed too since updated_at only has second resolution
+        tag = hashlib.sha1(repr(sorted(order.items())).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains_weak(tag):
+            return Response(status=304, headers={'ETag': quote_etag(tag)})
         cur.execute("SELECT product_id, quantity, price FROM order_items WHERE order_id=%s", (order_id,))
         items = cur.fetchall()
         order['items'] = items
     finally:
         conn.close()
-    return jsonify(order), 200
+    return jsonify(order), 200, {'ETag': quote_etag(tag)}
 
 
 @app.route('/api/v1/orders/<order_id>/details', methods=['GET'])
@@ -281,7 +631,7 @@ def get_order_details(order_id):
         return jsonify({'error': 'Database connection failed'}), 500
     try:
         cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT id, user_id, status, total_amount, created_at, updated_at FROM orders WHERE id=%s", (order_id,))
+        cur.execute("SELECT id, user_id, status, total_amount, shipping_address_id, created_at, updated_at FROM orders WHERE id=%s", (order_id,))
         order = cur.fetchone()
         if not order:
             return jsonify({'error': 'Not found'}), 404
@@ -290,46 +640,50 @@ def get_order_details(order_id):
     finally:
         conn.close()
 
-    # Fetch user details from user-service
-    user_obj = None
-    try:
-        uresp = requests.get(f"{USER_SERVICE_URL}/users/{order['user_id']}", headers=_fwd_auth_headers(), timeout=5)
-        if uresp.status_code == 200:
-            user_obj = uresp.json()
-    except Exception:
-        # keep user_obj as None on failure
-        pass
+    # Fan out to user-service and product-service concurrently under one deadline
+    headers = _fwd_auth_headers()
+    deadline = time.monotonic() + ENRICH_DEADLINE_SECONDS
+    futures = {
+        'user': _upstream_pool.submit(_get_json, f"{USER_SERVICE_URL}/users/{order['user_id']}", headers, deadline),
+        # We don't have a direct GET-by-id address endpoint; list and filter
+        'shippingAddress': _upstream_pool.submit(_get_json, f"{USER_SERVICE_URL}/users/{order['user_id']}/addresses", headers, deadline),
+    }
+    chunks = _product_chunks([it['product_id'] for it in items])
+    for n, chunk in enumerate(chunks):
+        futures[f'products.{n}'] = _upstream_pool.submit(
+            lambda ids: _fetch_product_chunk(ids, headers, timeout=_remaining(deadline)), chunk
+        )
+    results, errors = _collect(futures, deadline)
 
-    # Fetch product details for each item from product-service
+    user_obj = results.get('user')
+
+    products = {}
+    product_errors = {}
+    for n, chunk in enumerate(chunks):
+        products.update(results.get(f'products.{n}') or {})
+        if f'products.{n}' in errors:
+            err = errors.pop(f'products.{n}')
+            product_errors.update({pid: err for pid in chunk})
     enriched_items = []
     for it in items:
         pid = it['product_id']
-        product_obj = None
-        try:
-            presp = requests.get(f"{PRODUCT_SERVICE_URL}/products/{pid}", headers=_fwd_auth_headers(), timeout=5)
-            if presp.status_code == 200:
-                product_obj = presp.json()
-        except Exception:
-            pass
-        enriched_items.append({
+        entry = {
             'productId': pid,
             'quantity': it['quantity'],
-            'product': product_obj
-        })
-
-    # Fetch shipping address details if we have an id; otherwise optionally try default
+            'product': products.get(pid)
+        }
+        if pid in product_errors:
+            entry['error'] = product_errors[pid]
+            errors.setdefault('items', product_errors[pid])
+        enriched_items.append(entry)
+
+    # Pick the stored shipping address; otherwise fall back to the first one
     shipping_addr = None
-    try:
-        # We don't have a direct GET-by-id address endpoint; list and filter
-        ar = requests.get(f"{USER_SERVICE_URL}/users/{order['user_id']}/addresses", headers=_fwd_auth_headers(), timeout=5)
-        if ar.status_code == 200:
-            arr = ar.json() or []
-            if order.get('shipping_address_id'):
-                shipping_addr = next((a for a in arr if a.get('id') == order['shipping_address_id']), None)
-            else:
-                shipping_addr = arr[0] if len(arr) > 0 else None
-    except Exception:
-        pass
+    arr = results.get('shippingAddress') or []
+    if order.get('shipping_address_id'):
+        shipping_addr = next((a for a in arr if a.get('id') == order['shipping_address_id']), None)
+    else:
+        shipping_addr = arr[0] if len(arr) > 0 else None
 
     response = {
         'id': order['id'],
@@ -343,6 +697,9 @@ def get_order_details(order_id):
         'user': user_obj,
         'items': enriched_items
     }
+    if errors:
+        # Partial result: fields whose dependency failed or missed the deadline
+        response['errors'] = errors
 
     return jsonify(response), 200
 
@@ -363,19 +720,15 @@ def cancel_order(order_id):
             return jsonify({'status': 'CANCELLED'}), 200
         if row['status'] == 'PAID':
             return jsonify({'error': 'Cannot cancel a paid order'}), 409
-        # release stock
-        cur.execute("SELECT product_id, quantity FROM order_items WHERE order_id=%s", (order_id,))
-        items = cur.fetchall()
-        for it in items:
-            try:
-                requests.post(f"{PRODUCT_SERVICE_URL}/products/{it['product_id']}/release", json={'quantity': it['quantity']})
-            except Exception:
-                pass
         cur.execute("UPDATE orders SET status='CANCELLED' WHERE id=%s", (order_id,))
+        # Stock is released in bulk after commit by the background releaser
+        stock_release.enqueue_release(cur, order_id)
+        _emit_event(cur, 'order_cancelled', {'orderId': order_id})
         conn.commit()
     finally:
         conn.close()
-    _emit_event('order_cancelled', {'orderId': order_id})
+    if STOCK_RELEASER_IN_PROCESS:
+        after_this_request(_wake_releaser)
     return jsonify({'id': order_id, 'status': 'CANCELLED'}), 200
 
 
@@ -396,18 +749,27 @@ def pay_order(order_id):
         if row['status'] == 'PAID':
             return jsonify({'id': order_id, 'status': 'PAID'}), 200
         cur.execute("UPDATE orders SET status='PAID' WHERE id=%s", (order_id,))
+        _emit_event(cur, 'order_paid', {'orderId': order_id, 'userId': row['user_id'], 'totalAmount': float(row['total_amount'])})
         conn.commit()
-        user_id = row['user_id']
-        total_amount = float(row['total_amount'])
     finally:
         conn.close()
-    _emit_event('order_paid', {'orderId': order_id, 'userId': user_id, 'totalAmount': total_amount})
     return jsonify({'id': order_id, 'status': 'PAID'}), 200
 
 
 if __name__ == '__main__':
     import signal
     def _graceful(signum, frame):
+        # Publish already-committed outbox events before exiting
+        if OUTBOX_RELAY_IN_PROCESS:
+            try:
+                relay.stop()
+            except Exception:
+                pass
+        if STOCK_RELEASER_IN_PROCESS:
+            try:
+                releaser.stop()
+            except Exception:
+                pass
         if _coverage:
             try:
                 cov = _coverage.Coverage.current()
@@ -418,5 +780,9 @@ if __name__ == '__main__':
         raise SystemExit(0)
     signal.signal(signal.SIGTERM, _graceful)
     signal.signal(signal.SIGINT, _graceful)
+    if OUTBOX_RELAY_IN_PROCESS:
+        relay.start()
+    if STOCK_RELEASER_IN_PROCESS:
+        releaser.start()
     port = int(os.environ.get('FLASK_RUN_PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
@@ -24,8 +24,26 @@ CREATE TABLE IF NOT EXISTS order_items (
     CONSTRAINT chk_price_nonneg CHECK (price >= 0)
 );
 
+CREATE TABLE IF NOT EXISTS order_outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event_type VARCHAR(64) NOT NULL,
+    payload MEDIUMTEXT NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS stock_releases (
+    order_id VARCHAR(36) PRIMARY KEY,
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NULL,
+    items MEDIUMTEXT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id);
 CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
 CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at);
 CREATE INDEX IF NOT EXISTS idx_orders_shipaddr ON orders(shipping_address_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_status_created ON orders(user_id, status, created_at DESC, id);
 CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
@@ -0,0 +1,302 @@
+"""Order event delivery through a transactional outbox.
+
+Handlers write events into the order_outbox table in the same transaction as
+the order change, so an event exists iff the change was committed. The relay
+below drains that table: it claims a batch with SELECT ... FOR UPDATE SKIP
+LOCKED, publishes it with SendMessageBatch (up to 10 messages per call) and
+deletes what was sent in the same transaction. SKIP LOCKED lets several
+relays (threads or `python outbox_relay.py` processes) share the table
+without double-publishing; global ordering across relays is not guaranteed.
+
+A batch that cannot reach SQS at all is retried without counting an attempt,
+so an SQS outage never uses up a row's attempts. Entries SQS rejects count an
+attempt and wait an exponentially growing delay (next_attempt_at) before they
+are claimed again. Rows are parked (left in the table, counted in stats()) once
+they reach max_attempts, or at once when SQS reports a sender fault;
+`python outbox_relay.py --requeue` gives parked rows a fresh set of attempts.
+"""
+import abc
+import math
+import os
+import threading
+import time
+
+import boto3
+
+# SQS hard limit for SendMessageBatch
+SQS_MAX_BATCH = 10
+
+# How often stats() recounts pending and parked rows (seconds)
+BACKLOG_REFRESH_SECONDS = 10.0
+
+
+def sqs_client_from_env():
+    # Always honor explicit endpoint when provided (e.g., LocalStack: http://localstack:4566)
+    # For SQS, SendMessage talks to the service endpoint and passes QueueUrl as a parameter,
+    # so we must set endpoint_url to hit LocalStack instead of real AWS.
+    endpoint_url = os.environ.get('AWS_ENDPOINT') or os.environ.get('AWS_ENDPOINT_URL')
+    return boto3.client(
+        'sqs',
+        region_name=os.environ.get('AWS_REGION', 'us-east-1'),
+        endpoint_url=endpoint_url
+    )
+
+
+def send_message_batch(client, queue_url, messages):
+    """Send up to SQS_MAX_BATCH (id, body) pairs in one call.
+    Returns (sent_ids, failed) where failed is [(id, body, retryable)].
+    Transport errors propagate to the caller.
+    """
+    bodies = {str(i): body for i, body in messages}
+    entries = [{'Id': str(i), 'MessageBody': body} for i, body in messages]
+    resp = client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+    sent = [e['Id'] for e in resp.get('Successful', [])]
+    failed = [(f['Id'], bodies[f['Id']], not f.get('SenderFault', False)) for f in resp.get('Failed', [])]
+    return sent, failed
+
+
+def write_outbox(cursor, event_type, body):
+    """Record an event using the caller's cursor; visible to relays on commit."""
+    cursor.execute(
+        "INSERT INTO order_outbox (event_type, payload) VALUES (%s, %s)",
+        (event_type, body)
+    )
+
+
+class PollingWorker(abc.ABC):
+    """Background loop around run_once(), shared by the outbox relay and the
+    stock releaser. Subclasses claim up to batch_size due rows of `table` per
+    run_once() and return how many they claimed. Rows that failed wait in
+    next_attempt_at; rows with max_attempts attempts are parked.
+    """
+
+    # Set by subclasses: the work table and its key column
+    table = None
+    key = None
+
+    def __init__(self, name, batch_size=100, poll_interval=0.5, backoff_max=30.0, max_attempts=10):
+        self.name = name
+        self.batch_size = int(batch_size)
+        self.poll_interval = float(poll_interval)
+        self.backoff_max = float(backoff_max)
+        # Rows failing this many times are parked in the table for inspection
+        self.max_attempts = int(max_attempts)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._counters = {'errors': 0}
+        self._backlog = {'pending': None, 'parked': None}
+        self._backlog_at = None
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    @abc.abstractmethod
+    def run_once(self):
+        """Claim and process up to batch_size rows; returns how many were claimed."""
+
+    def run_forever(self):
+        """Drain continuously until stop(); backs off exponentially on errors."""
+        backoff = self.poll_interval
+        while not self._stopping.is_set():
+            try:
+                claimed = self.run_once()
+                backoff = self.poll_interval
+            except Exception as e:
+                self._count('errors')
+                print(f"{self.name} error: {e}")
+                claimed = 0
+                backoff = min(backoff * 2, self.backoff_max)
+            if claimed < self.batch_size:
+                if backoff > self.poll_interval:
+                    # Failing: wake() hints from new requests must not cut the backoff short
+                    self._stopping.wait(backoff)
+                else:
+                    # Idle: sleep until the poll interval, a wake() or stop()
+                    self._wake.wait(backoff)
+                self._wake.clear()
+
+    def wake(self):
+        """Hint that new rows were committed so the worker doesn't wait out its poll.
+        Ignored while the worker is backing off after errors.
+        """
+        self._wake.set()
+
+    def _retry_delay(self, attempts):
+        return math.ceil(min(self.poll_interval * 2 ** attempts, self.backoff_max))
+
+    def _retry_later(self, cur, keys, attempts, charge):
+        """Hide keys from claims until their retry delay has passed. charge=True
+        counts the failure as an attempt; attempts maps key -> attempts so far.
+        """
+        by_delay = {}
+        for k in keys:
+            by_delay.setdefault(self._retry_delay(attempts[k] + charge), []).append(k)
+        for delay, group in by_delay.items():
+            cur.execute(
+                f"UPDATE {self.table} SET attempts = attempts + %s, next_attempt_at = UTC_TIMESTAMP() + INTERVAL %s SECOND "
+                f"WHERE {self.key} IN ({', '.join(['%s'] * len(group))})",
+                (int(charge), delay, *group)
+            )
+
+    def _park(self, cur, keys):
+        cur.execute(
+            f"UPDATE {self.table} SET attempts = %s WHERE {self.key} IN ({', '.join(['%s'] * len(keys))})",
+            (self.max_attempts, *keys)
+        )
+
+    def _refresh_backlog(self, cur, force=False):
+        """Recount pending and parked rows for stats(), at most every BACKLOG_REFRESH_SECONDS."""
+        now = time.monotonic()
+        if not force and self._backlog_at is not None and now - self._backlog_at < BACKLOG_REFRESH_SECONDS:
+            return
+        cur.execute(
+            f"SELECT COUNT(*) AS total, COALESCE(SUM(CASE WHEN attempts >= %s THEN 1 ELSE 0 END), 0) AS parked FROM {self.table}",
+            (self.max_attempts,)
+        )
+        row = cur.fetchone()
+        total, parked = int(row['total']), int(row['parked'])
+        with self._lock:
+            self._backlog = {'pending': total - parked, 'parked': parked}
+            self._backlog_at = now
+
+    def requeue(self):
+        """Give parked rows a fresh set of attempts; returns how many were requeued."""
+        conn = self.connect()
+        if not conn:
+            raise RuntimeError('Database connection failed')
+        cur = conn.cursor(dictionary=True)
+        try:
+            cur.execute(
+                f"UPDATE {self.table} SET attempts = 0, next_attempt_at = NULL WHERE attempts >= %s",
+                (self.max_attempts,)
+            )
+            requeued = cur.rowcount
+            self._refresh_backlog(cur, force=True)
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+        self.wake()
+        return requeued
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+
+    def request_stop(self):
+        """Ask run_forever to return after the current batch (signal-handler safe)."""
+        self._stopping.set()
+        self._wake.set()
+
+    def stop(self, timeout=5.0):
+        """Stop the loop and make a final pass over committed rows; used on SIGTERM."""
+        self.request_stop()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            while self.run_once() >= self.batch_size:
+                pass
+        except Exception as e:
+            print(f"{self.name} final pass failed: {e}")
+
+    def stats(self):
+        """Counters since start, plus the pending and parked row counts as of the last recount."""
+        with self._lock:
+            out = dict(self._counters)
+            out.update(self._backlog)
+        return out
+
+
+class OutboxRelay(PollingWorker):
+    table = 'order_outbox'
+    key = 'id'
+
+    def __init__(self, connect, client, queue_url, batch_size=100, poll_interval=0.5,
+                 max_attempts=10, backoff_max=30.0):
+        super().__init__('outbox-relay', batch_size, poll_interval, backoff_max, max_attempts)
+        self.connect = connect
+        self.client = client
+        self.queue_url = queue_url
+        self._counters.update({'sent': 0, 'failed': 0, 'batches': 0})
+
+    def stats(self):
+        # queued/sent/dropped as reported by the in-memory publisher the outbox replaced:
+        # events waiting to be published, and events given up on (parked rows)
+        out = super().stats()
+        out['queued'] = out['pending']
+        out['dropped'] = out['parked']
+        return out
+
+    def run_once(self):
+        """Claim, publish and delete one batch. Returns the number of rows claimed."""
+        conn = self.connect()
+        if not conn:
+            raise RuntimeError('Database connection failed')
+        cur = conn.cursor(dictionary=True)
+        try:
+            cur.execute(
+                "SELECT id, payload, attempts FROM order_outbox "
+                "WHERE attempts < %s AND (next_attempt_at IS NULL OR next_attempt_at <= UTC_TIMESTAMP()) "
+                "ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+                (self.max_attempts, self.batch_size)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                self._refresh_backlog(cur)
+                conn.rollback()
+                return 0
+            attempts = {r['id']: r['attempts'] for r in rows}
+            sent_ids, rejected, parked, unsent = [], [], [], []
+            for start in range(0, len(rows), SQS_MAX_BATCH):
+                chunk = rows[start:start + SQS_MAX_BATCH]
+                try:
+                    sent, failed = send_message_batch(self.client, self.queue_url, [(r['id'], r['payload']) for r in chunk])
+                    self._count('batches')
+                    sent_ids += [int(i) for i in sent]
+                    for i, _, retryable in failed:
+                        (rejected if retryable else parked).append(int(i))
+                except Exception as e:
+                    # SQS never saw these: retry them without using up an attempt
+                    print(f"Failed to send SQS batch: {e}")
+                    unsent += [r['id'] for r in chunk]
+            if sent_ids:
+                cur.execute(
+                    f"DELETE FROM order_outbox WHERE id IN ({', '.join(['%s'] * len(sent_ids))})",
+                    tuple(sent_ids)
+                )
+            self._retry_later(cur, rejected, attempts, charge=True)
+            self._retry_later(cur, unsent, attempts, charge=False)
+            if parked:
+                self._park(cur, parked)
+            self._refresh_backlog(cur, force=bool(rejected or parked))
+            conn.commit()
+            self._count('sent', len(sent_ids))
+            self._count('failed', len(rejected) + len(parked) + len(unsent))
+            if (rejected or unsent) and not sent_ids:
+                raise RuntimeError(f'{len(rejected) + len(unsent)} outbox events could not be published')
+            return len(rows)
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+
+def relay_from_env(connect, client):
+    return OutboxRelay(
+        connect,
+        client,
+        os.environ.get('SQS_QUEUE_URL'),
+        batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', '100')),
+        poll_interval=float(os.environ.get('OUTBOX_POLL_INTERVAL', '0.5')),
+        max_attempts=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '10')),
+    )
@@ -0,0 +1,11 @@
+-- Composite index for keyset pagination in GET /orders:
+-- WHERE user_id=? [AND status=?] ORDER BY created_at DESC, id ASC, seeking on (created_at, id)
+USE order_db;
+
+-- created_at is stored DESC so the mixed-direction ORDER BY is served by the index without a filesort
+SET @idx_exists = (
+  SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'orders' AND INDEX_NAME = 'idx_orders_user_status_created'
+);
+SET @stmt = IF(@idx_exists > 0, 'SELECT 1', 'CREATE INDEX idx_orders_user_status_created ON orders(user_id, status, created_at DESC, id)');
+PREPARE s FROM @stmt; EXECUTE s; DEALLOCATE PREPARE s;
@@ -0,0 +1,10 @@
+-- Transactional outbox for order events; drained by events.OutboxRelay
+USE order_db;
+
+CREATE TABLE IF NOT EXISTS order_outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event_type VARCHAR(64) NOT NULL,
+    payload MEDIUMTEXT NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,9 @@
+-- Pending stock releases for cancelled orders; drained by stock_release.StockReleaser
+USE order_db;
+
+CREATE TABLE IF NOT EXISTS stock_releases (
+    order_id VARCHAR(36) PRIMARY KEY,
+    attempts INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (order_id) REFERENCES orders(id)
+);
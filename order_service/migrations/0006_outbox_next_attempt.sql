@@ -0,0 +1,4 @@
+-- Outbox rows that failed wait until next_attempt_at (UTC) before a relay claims them again
+USE order_db;
+
+ALTER TABLE order_outbox ADD COLUMN next_attempt_at DATETIME NULL;
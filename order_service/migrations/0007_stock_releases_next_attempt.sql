@@ -0,0 +1,4 @@
+-- Stock releases that failed wait until next_attempt_at (UTC) before the releaser claims them again
+USE order_db;
+
+ALTER TABLE stock_releases ADD COLUMN next_attempt_at DATETIME NULL;
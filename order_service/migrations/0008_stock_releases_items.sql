@@ -0,0 +1,6 @@
+-- stock_releases also holds reservations whose order was never created: their lines are
+-- stored in items (JSON) instead of order_items, so order_id no longer references orders
+USE order_db;
+
+ALTER TABLE stock_releases DROP FOREIGN KEY stock_releases_ibfk_1;
+ALTER TABLE stock_releases ADD COLUMN items MEDIUMTEXT NULL;
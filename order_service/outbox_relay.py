@@ -0,0 +1,37 @@
+"""Standalone outbox relay: `python outbox_relay.py`.
+
+Publishes order_outbox rows to SQS_QUEUE_URL. Several copies can run side by
+side (and next to the in-process relay) since rows are claimed with SKIP LOCKED.
+`python outbox_relay.py --requeue` gives parked rows a fresh set of attempts
+and exits.
+"""
+import argparse
+import signal
+
+import db_pool
+import events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish order_outbox rows to SQS.')
+    parser.add_argument('--requeue', action='store_true', help='retry parked rows, then exit')
+    args = parser.parse_args()
+    pool = db_pool.pool_from_env('order_db')
+    relay = events.relay_from_env(pool.acquire, events.sqs_client_from_env())
+    if args.requeue:
+        print('[outbox_relay] requeued', relay.requeue(), 'parked rows')
+        return
+
+    def _graceful(signum, frame):
+        # run_forever returns after the current batch; the final flush happens below
+        relay.request_stop()
+    signal.signal(signal.SIGTERM, _graceful)
+    signal.signal(signal.SIGINT, _graceful)
+    print('[outbox_relay] started')
+    relay.run_forever()
+    relay.stop()
+    print('[outbox_relay] stopped', relay.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Deferred stock release for cancelled orders.
+
+cancel_order only flips the order status and enqueues a stock_releases row in
+the same transaction, so the order row lock is held for one local UPDATE.
+create_order queues the same kind of row, carrying the reserved lines, when
+it cannot store an order whose stock it already reserved.
+StockReleaser drains that table off the request path: one bulk
+/products/release call per order. Delivery is at-least-once; a crash between
+the release call and the commit can release an order's stock twice.
+
+When product_service cannot be reached (connection error, timeout, 5xx, 429)
+the release is retried after a delay without counting an attempt, so an
+outage during a burst of cancellations never uses up a row's attempts. A
+release product_service refuses (any other 4xx) counts an attempt; after
+max_attempts the row is parked (left in the table, counted in stats()).
+`python stock_release.py --requeue` gives parked rows a fresh set of attempts.
+"""
+import argparse
+import json
+import os
+
+import requests
+
+import db_pool
+from events import PollingWorker
+
+
+def enqueue_release(cursor, order_id, items=None):
+    """Queue stock for release; visible to the worker on commit. Releases the
+    order's order_items, or `items` ([{'productId', 'quantity'}]) for a
+    reservation whose order was never created.
+    """
+    cursor.execute(
+        "INSERT IGNORE INTO stock_releases (order_id, items) VALUES (%s, %s)",
+        (order_id, json.dumps(items) if items is not None else None)
+    )
+
+
+def _unavailable(error):
+    """True if product_service could not handle the call, as opposed to refusing it."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return True
+    return response.status_code >= 500 or response.status_code in (408, 429)
+
+
+class StockReleaser(PollingWorker):
+    table = 'stock_releases'
+    key = 'order_id'
+
+    def __init__(self, connect, product_service_url, auth_headers, batch_size=20,
+                 poll_interval=1.0, max_attempts=20, timeout=5.0, backoff_max=60.0):
+        super().__init__('stock-releaser', batch_size, poll_interval, backoff_max, max_attempts)
+        self.connect = connect
+        self.product_service_url = product_service_url
+        # Callable returning headers; releases run outside any client request
+        self.auth_headers = auth_headers
+        self.timeout = float(timeout)
+        self._counters.update({'released': 0, 'failed': 0})
+
+    def _release(self, lines):
+        resp = requests.post(
+            f"{self.product_service_url}/products/release",
+            json={'items': lines},
+            headers=self.auth_headers(),
+            timeout=self.timeout
+        )
+        resp.raise_for_status()
+
+    def run_once(self):
+        """Claim and process one batch of jobs. Returns the number of jobs claimed."""
+        conn = self.connect()
+        if not conn:
+            raise RuntimeError('Database connection failed')
+        cur = conn.cursor(dictionary=True)
+        try:
+            cur.execute(
+                "SELECT order_id, attempts, items FROM stock_releases "
+                "WHERE attempts < %s AND (next_attempt_at IS NULL OR next_attempt_at <= UTC_TIMESTAMP()) "
+                "ORDER BY created_at LIMIT %s FOR UPDATE SKIP LOCKED",
+                (self.max_attempts, self.batch_size)
+            )
+            jobs = cur.fetchall()
+            attempts = {r['order_id']: r['attempts'] for r in jobs}
+            order_ids = list(attempts)
+            if not order_ids:
+                self._refresh_backlog(cur)
+                conn.rollback()
+                return 0
+            lines = {r['order_id']: json.loads(r['items']) if r['items'] is not None else [] for r in jobs}
+            placed = [r['order_id'] for r in jobs if r['items'] is None]
+            if placed:
+                cur.execute(
+                    f"SELECT order_id, product_id, quantity FROM order_items WHERE order_id IN ({', '.join(['%s'] * len(placed))})",
+                    tuple(placed)
+                )
+                for it in cur.fetchall():
+                    lines[it['order_id']].append({'productId': it['product_id'], 'quantity': it['quantity']})
+            done, refused, unavailable = [], [], []
+            for oid in order_ids:
+                try:
+                    if lines[oid]:
+                        self._release(lines[oid])
+                    done.append(oid)
+                except Exception as e:
+                    print(f"Failed to release stock for order {oid}: {e}")
+                    (unavailable if _unavailable(e) else refused).append(oid)
+            if done:
+                cur.execute(
+                    f"DELETE FROM stock_releases WHERE order_id IN ({', '.join(['%s'] * len(done))})",
+                    tuple(done)
+                )
+            self._retry_later(cur, refused, attempts, charge=True)
+            self._retry_later(cur, unavailable, attempts, charge=False)
+            self._refresh_backlog(cur, force=bool(refused))
+            conn.commit()
+            failed = refused + unavailable
+            self._count('released', len(done))
+            self._count('failed', len(failed))
+            if failed and not done:
+                raise RuntimeError(f'{len(failed)} stock releases failed')
+            return len(order_ids)
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+
+def releaser_from_env(connect, product_service_url, auth_headers):
+    return StockReleaser(
+        connect,
+        product_service_url,
+        auth_headers,
+        batch_size=int(os.environ.get('STOCK_RELEASE_BATCH_SIZE', '20')),
+        poll_interval=float(os.environ.get('STOCK_RELEASE_POLL_INTERVAL', '1.0')),
+        max_attempts=int(os.environ.get('STOCK_RELEASE_MAX_ATTEMPTS', '20')),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the stock_releases queue.')
+    parser.add_argument('--requeue', action='store_true', help='retry parked releases')
+    args = parser.parse_args()
+    if not args.requeue:
+        parser.error('nothing to do (the releaser itself runs inside order_service)')
+    pool = db_pool.pool_from_env('order_db')
+    worker = releaser_from_env(pool.acquire, os.environ.get('PRODUCT_SERVICE_URL'), lambda: {})
+    print('[stock_release] requeued', worker.requeue(), 'parked releases')
+
+
+if __name__ == '__main__':
+    main()
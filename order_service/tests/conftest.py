@@ -0,0 +1,77 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(SERVICE_DIR), 'common'))
+
+import fake_mysql  # noqa: E402
+
+SCHEMA = """
+    CREATE TABLE order_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, event_type TEXT NOT NULL, payload TEXT NOT NULL,
+        attempts INT NOT NULL DEFAULT 0, next_attempt_at DATETIME NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE stock_releases (
+        order_id TEXT PRIMARY KEY, attempts INT NOT NULL DEFAULT 0, next_attempt_at DATETIME NULL,
+        items TEXT NULL, created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, order_id TEXT NOT NULL, product_id TEXT NOT NULL,
+        quantity INT NOT NULL, price DECIMAL(10, 2) NOT NULL
+    );
+"""
+
+
+@pytest.fixture(scope='session')
+def order_app():
+    # Loaded under its own name: every service has an app.py
+    spec = importlib.util.spec_from_file_location('order_service_app', os.path.join(SERVICE_DIR, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A sqlite database with the outbox tables (see common/fake_mysql.py)."""
+    return fake_mysql.Database(tmp_path / 'order.db', SCHEMA)
+
+
+@pytest.fixture
+def connect(db):
+    return db.connect
+
+
+@pytest.fixture
+def mysql_connect():
+    """connect() for a real MySQL test database, from TEST_MYSQL_HOST/PORT/USER/PASSWORD/DB."""
+    host = os.environ.get('TEST_MYSQL_HOST')
+    if not host:
+        pytest.skip('TEST_MYSQL_HOST not set')
+    import mysql.connector
+    params = {
+        'host': host,
+        'port': int(os.environ.get('TEST_MYSQL_PORT', '3306')),
+        'user': os.environ.get('TEST_MYSQL_USER', 'root'),
+        'password': os.environ.get('TEST_MYSQL_PASSWORD', ''),
+        'database': os.environ.get('TEST_MYSQL_DB', 'order_test'),
+    }
+    setup = mysql.connector.connect(**params)
+    cur = setup.cursor()
+    cur.execute("DROP TABLE IF EXISTS order_outbox")
+    cur.execute(
+        "CREATE TABLE order_outbox (id BIGINT AUTO_INCREMENT PRIMARY KEY, event_type VARCHAR(64) NOT NULL, "
+        "payload MEDIUMTEXT NOT NULL, attempts INT NOT NULL DEFAULT 0, next_attempt_at DATETIME NULL, "
+        "created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    setup.commit()
+    yield lambda: mysql.connector.connect(**params)
+    cur.execute("DROP TABLE IF EXISTS order_outbox")
+    setup.commit()
+    cur.close()
+    setup.close()
@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+import events
+
+
+class FakeSQS:
+    """Records SendMessageBatch calls; `fail` ids come back in Failed, `error` raises."""
+
+    def __init__(self, fail=(), error=None, sender_fault=False):
+        self.fail = {str(i) for i in fail}
+        self.error = error
+        self.sender_fault = sender_fault
+        self.batches = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if self.error:
+            raise self.error
+        self.batches.append([e['Id'] for e in Entries])
+        ok = [{'Id': e['Id']} for e in Entries if e['Id'] not in self.fail]
+        failed = [{'Id': e['Id'], 'SenderFault': self.sender_fault} for e in Entries if e['Id'] in self.fail]
+        return {'Successful': ok, 'Failed': failed}
+
+
+def write(connect, n):
+    conn = connect()
+    cur = conn.cursor()
+    for i in range(n):
+        events.write_outbox(cur, 'order_created', f'{{"n": {i}}}')
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def rows(db):
+    return db.execute("SELECT id, attempts FROM order_outbox ORDER BY id")
+
+
+def make_due(db):
+    db.execute("UPDATE order_outbox SET next_attempt_at = NULL")
+
+
+def test_publishes_in_sqs_sized_batches_and_deletes(db, connect):
+    write(connect, 23)
+    client = FakeSQS()
+    relay = events.OutboxRelay(connect, client, 'q', batch_size=100)
+    assert relay.run_once() == 23
+    assert [len(b) for b in client.batches] == [10, 10, 3]
+    assert rows(db) == []
+    assert relay.stats()['sent'] == 23
+    assert relay.run_once() == 0
+
+
+def test_claims_at_most_batch_size(db, connect):
+    write(connect, 5)
+    relay = events.OutboxRelay(connect, FakeSQS(), 'q', batch_size=2)
+    assert relay.run_once() == 2
+    assert len(rows(db)) == 3
+
+
+def test_rejected_entries_count_an_attempt_and_wait(db, connect):
+    write(connect, 3)
+    relay = events.OutboxRelay(connect, FakeSQS(fail=[2]), 'q')
+    assert relay.run_once() == 3
+    assert rows(db) == [(2, 1)]
+    assert relay.stats()['failed'] == 1
+    # Not claimed again until its retry delay has passed
+    assert relay.run_once() == 0
+    make_due(db)
+    with pytest.raises(RuntimeError, match='could not be published'):
+        relay.run_once()
+    assert rows(db) == [(2, 2)]
+
+
+def test_transport_error_is_retried_without_counting_attempts(db, connect):
+    write(connect, 2)
+    client = FakeSQS(error=RuntimeError('down'))
+    relay = events.OutboxRelay(connect, client, 'q', max_attempts=2)
+    for _ in range(5):
+        make_due(db)
+        with pytest.raises(RuntimeError, match='could not be published'):
+            relay.run_once()
+    assert rows(db) == [(1, 0), (2, 0)]
+    assert relay.stats()['parked'] == 0
+    client.error = None
+    make_due(db)
+    assert relay.run_once() == 2
+    assert rows(db) == []
+
+
+def test_rows_past_max_attempts_are_parked(db, connect):
+    write(connect, 2)
+    relay = events.OutboxRelay(connect, FakeSQS(fail=[1]), 'q', max_attempts=2)
+    relay.run_once()
+    make_due(db)
+    with pytest.raises(RuntimeError):
+        relay.run_once()
+    make_due(db)
+    assert relay.run_once() == 0
+    assert rows(db) == [(1, 2)]
+    assert relay.stats()['parked'] == 1
+    assert relay.stats()['pending'] == 0
+    assert relay.stats()['queued'] == 0
+
+
+def test_sender_fault_parks_at_once(db, connect):
+    write(connect, 1)
+    relay = events.OutboxRelay(connect, FakeSQS(fail=[1], sender_fault=True), 'q', max_attempts=5)
+    assert relay.run_once() == 1
+    assert rows(db) == [(1, 5)]
+    assert relay.stats()['parked'] == 1
+    assert relay.stats()['dropped'] == 1
+
+
+def test_requeue_retries_parked_rows(db, connect):
+    write(connect, 1)
+    db.execute("UPDATE order_outbox SET attempts = 3")
+    relay = events.OutboxRelay(connect, FakeSQS(), 'q', max_attempts=3)
+    assert relay.run_once() == 0
+    assert relay.requeue() == 1
+    assert relay.stats()['parked'] == 0
+    assert relay.run_once() == 1
+    assert rows(db) == []
+
+
+def test_wake_does_not_cut_error_backoff_short(connect):
+    relay = events.OutboxRelay(connect, FakeSQS(), 'q', poll_interval=0.05, backoff_max=10)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise RuntimeError('down')
+    relay.run_once = failing
+    relay.start()
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        relay.wake()
+        time.sleep(0.005)
+    relay.request_stop()
+    relay._thread.join(5)
+    # Backoff of 0.1s, 0.2s, 0.4s: at most four runs in half a second
+    assert len(calls) <= 4
+
+
+def test_stop_drains_committed_rows(db, connect):
+    write(connect, 5)
+    relay = events.OutboxRelay(connect, FakeSQS(), 'q', batch_size=2)
+    relay.stop()
+    assert rows(db) == []
+
+
+def concurrent_relays(connect):
+    write(connect, 4)
+    inside, proceed = threading.Event(), threading.Event()
+
+    class Blocking(FakeSQS):
+        def send_message_batch(self, QueueUrl, Entries):
+            inside.set()
+            proceed.wait(10)
+            return super().send_message_batch(QueueUrl, Entries)
+
+    first, second = Blocking(), FakeSQS()
+    relay_a = events.OutboxRelay(connect, first, 'q', batch_size=2)
+    relay_b = events.OutboxRelay(connect, second, 'q', batch_size=2)
+    worker = threading.Thread(target=relay_a.run_once)
+    worker.start()
+    assert inside.wait(10)
+    # relay_a holds its two rows locked; relay_b must take the other two without waiting
+    assert relay_b.run_once() == 2
+    proceed.set()
+    worker.join(10)
+    claimed_a, claimed_b = set(first.batches[0]), set(second.batches[0])
+    assert not claimed_a & claimed_b
+    assert len(claimed_a | claimed_b) == 4
+
+
+def test_concurrent_relays_skip_locked_rows(connect):
+    concurrent_relays(connect)
+
+
+def test_concurrent_relays_skip_locked_rows_on_mysql(mysql_connect):
+    concurrent_relays(mysql_connect)
@@ -0,0 +1,99 @@
+import time
+
+import jwt
+import mysql.connector
+import pytest
+import requests
+
+
+class Resp:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body or {}
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error', response=self)
+
+
+class Posts:
+    """Stands in for requests.post: reserves succeed, releases answer `release_status`."""
+
+    def __init__(self):
+        self.release_status = 200
+        self.released = []
+
+    def __call__(self, url, json, headers, timeout=None):
+        if url.endswith('/products/reserve'):
+            return Resp(200, {'items': json['items']})
+        self.released.append(json['items'])
+        return Resp(self.release_status)
+
+
+class FailingOrderInsert:
+    """A connection whose INSERT INTO orders fails, like a lost MySQL connection would."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, **kwargs):
+        cur = self._conn.cursor(**kwargs)
+        execute = cur.execute
+
+        def failing(sql, params=()):
+            if sql.startswith('INSERT INTO orders'):
+                raise mysql.connector.Error(msg='Lost connection to MySQL server', errno=2013)
+            return execute(sql, params)
+        cur.execute = failing
+        return cur
+
+
+@pytest.fixture
+def posts(order_app, monkeypatch):
+    fake = Posts()
+    monkeypatch.setattr(order_app.requests, 'post', fake)
+    monkeypatch.setattr(order_app, '_run_checks', lambda checks, deadline: {
+        'user': None, 'shippingAddress': None, 'products': (10.0, {'p1': 2}),
+    })
+    monkeypatch.setattr(order_app, 'STOCK_RELEASER_IN_PROCESS', False)
+    return fake
+
+
+def place(order_app):
+    token = jwt.encode({'sub': 'u1', 'exp': int(time.time()) + 300}, order_app.JWT_SECRET, algorithm=order_app.JWT_ALG)
+    return order_app.app.test_client().post(
+        '/api/v1/orders',
+        json={'userId': 'u1', 'items': [{'productId': 'p1', 'quantity': 2}]},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+
+def queued(db):
+    return [items for (items,) in db.execute("SELECT items FROM stock_releases")]
+
+
+def test_no_connection_releases_directly(order_app, db, posts, monkeypatch):
+    monkeypatch.setattr(order_app, 'get_db_connection', lambda: None)
+    assert place(order_app).status_code == 500
+    assert posts.released == [[{'productId': 'p1', 'quantity': 2}]]
+
+
+def test_no_connection_queues_when_release_fails(order_app, db, posts, monkeypatch):
+    posts.release_status = 503
+    connections = iter([None, db.connect()])
+    monkeypatch.setattr(order_app, 'get_db_connection', lambda: next(connections))
+    assert place(order_app).status_code == 500
+    assert queued(db) == ['[{"productId": "p1", "quantity": 2}]']
+
+
+def test_failed_insert_queues_the_release(order_app, db, posts, monkeypatch):
+    monkeypatch.setattr(order_app, 'get_db_connection', lambda: FailingOrderInsert(db.connect()))
+    assert place(order_app).status_code == 500
+    assert posts.released == []
+    assert queued(db) == ['[{"productId": "p1", "quantity": 2}]']
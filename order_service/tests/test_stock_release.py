@@ -0,0 +1,144 @@
+import pytest
+import requests
+
+import stock_release
+
+
+class Posts:
+    """Stands in for requests.post; orders whose first product is in `fail` get
+    a 503, those in `refuse` a 400.
+    """
+
+    def __init__(self, fail=(), refuse=()):
+        self.fail = set(fail)
+        self.refuse = set(refuse)
+        self.calls = []
+
+    def __call__(self, url, json, headers, timeout):
+        self.calls.append((url, json, headers))
+        product_id = json['items'][0]['productId']
+        if product_id in self.fail:
+            raise requests.HTTPError('503 Server Error', response=type('Resp', (), {'status_code': 503})())
+        if product_id in self.refuse:
+            raise requests.HTTPError('400 Client Error', response=type('Resp', (), {'status_code': 400})())
+        return type('Resp', (), {'raise_for_status': lambda self: None})()
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    fake = Posts()
+    monkeypatch.setattr(stock_release.requests, 'post', fake)
+    return fake
+
+
+def order(connect, order_id, *lines):
+    conn = connect()
+    cur = conn.cursor()
+    for product_id, qty in lines:
+        cur.execute(
+            "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (%s, %s, %s, %s)",
+            (order_id, product_id, qty, 1)
+        )
+    stock_release.enqueue_release(cur, order_id)
+    conn.commit()
+
+
+def jobs(db):
+    return db.execute("SELECT order_id, attempts FROM stock_releases ORDER BY order_id")
+
+
+def make_due(db):
+    db.execute("UPDATE stock_releases SET next_attempt_at = NULL")
+
+
+def releaser(connect, **kwargs):
+    return stock_release.StockReleaser(connect, 'http://products/api/v1', lambda: {'Authorization': 'Bearer s'}, **kwargs)
+
+
+def test_releases_each_order_in_one_call(db, connect, posts):
+    order(connect, 'o1', ('p1', 2), ('p2', 1))
+    order(connect, 'o2', ('p3', 5))
+    worker = releaser(connect)
+    assert worker.run_once() == 2
+    assert sorted((c[0], tuple(i['productId'] for i in c[1]['items'])) for c in posts.calls) == [
+        ('http://products/api/v1/products/release', ('p1', 'p2')),
+        ('http://products/api/v1/products/release', ('p3',)),
+    ]
+    assert posts.calls[0][2] == {'Authorization': 'Bearer s'}
+    assert jobs(db) == []
+    assert worker.stats()['released'] == 2
+
+
+def test_enqueue_is_idempotent(db, connect, posts):
+    order(connect, 'o1', ('p1', 1))
+    conn = connect()
+    stock_release.enqueue_release(conn.cursor(), 'o1')
+    conn.commit()
+    assert jobs(db) == [('o1', 0)]
+
+
+def test_unavailable_product_service_is_retried_without_counting_attempts(db, connect, posts):
+    posts.fail.add('p2')
+    order(connect, 'o1', ('p1', 1))
+    order(connect, 'o2', ('p2', 1))
+    worker = releaser(connect, max_attempts=2)
+    assert worker.run_once() == 2
+    assert jobs(db) == [('o2', 0)]
+    # Waits out its retry delay, then is retried however often it fails
+    assert worker.run_once() == 0
+    for _ in range(5):
+        make_due(db)
+        with pytest.raises(RuntimeError, match='stock releases failed'):
+            worker.run_once()
+    assert jobs(db) == [('o2', 0)]
+    posts.fail.clear()
+    make_due(db)
+    assert worker.run_once() == 1
+    assert jobs(db) == []
+
+
+def test_connection_error_is_not_counted(db, connect, posts, monkeypatch):
+    order(connect, 'o1', ('p1', 1))
+
+    def down(*args, **kwargs):
+        raise requests.ConnectionError('refused')
+    monkeypatch.setattr(stock_release.requests, 'post', down)
+    with pytest.raises(RuntimeError):
+        releaser(connect).run_once()
+    assert jobs(db) == [('o1', 0)]
+
+
+def test_refused_release_is_parked_after_max_attempts(db, connect, posts):
+    posts.refuse.add('p1')
+    order(connect, 'o1', ('p1', 1))
+    worker = releaser(connect, max_attempts=2)
+    for _ in range(2):
+        make_due(db)
+        with pytest.raises(RuntimeError):
+            worker.run_once()
+    make_due(db)
+    assert worker.run_once() == 0
+    assert jobs(db) == [('o1', 2)]
+    assert worker.stats()['parked'] == 1
+    posts.refuse.clear()
+    assert worker.requeue() == 1
+    assert worker.run_once() == 1
+    assert jobs(db) == []
+
+
+def test_order_without_items_is_cleared(db, connect, posts):
+    conn = connect()
+    stock_release.enqueue_release(conn.cursor(), 'o1')
+    conn.commit()
+    assert releaser(connect).run_once() == 1
+    assert posts.calls == []
+    assert jobs(db) == []
+
+
+def test_releases_lines_of_an_order_that_was_never_created(db, connect, posts):
+    conn = connect()
+    stock_release.enqueue_release(conn.cursor(), 'o1', [{'productId': 'p1', 'quantity': 3}])
+    conn.commit()
+    assert releaser(connect).run_once() == 1
+    assert posts.calls[0][1] == {'items': [{'productId': 'p1', 'quantity': 3}]}
+    assert jobs(db) == []
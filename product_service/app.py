@@ -1,9 +1,17 @@
 import os
+import re
+import json
+import base64
+import hashlib
 import uuid
 import mysql.connector
-from flask import Flask, jsonify, request
+import auth_cache
+import db_pool
+import inventory
+import product_cache
+from flask import Flask, Response, jsonify, request, stream_with_context
+from werkzeug.http import quote_etag
 import coverage as _coverage
-import jwt
 
 app = Flask(__name__)
 JWT_SECRET = os.environ.get('JWT_SECRET', 'dev-secret-change-me')
@@ -11,16 +19,12 @@ JWT_ALG = 'HS256'
 
 from functools import wraps
 
+# Verified tokens are cached per process until they expire
+authenticator = auth_cache.authenticator_from_env(JWT_SECRET, JWT_ALG)
+
+
 def _auth_ok():
-    auth = request.headers.get('Authorization') or ''
-    if not auth.startswith('Bearer '):
-        return False
-    token = auth.split(' ', 1)[1].strip()
-    try:
-        jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return True
-    except Exception:
-        return False
+    return authenticator.claims(request.headers) is not None
 
 def require_auth(fn):
     @wraps(fn)
@@ -31,20 +35,30 @@ def require_auth(fn):
     return wrapper
 
 
+# Pooled connections: close() hands the connection back instead of disconnecting.
+# READ COMMITTED so a stock UPDATE whose condition fails does not keep its row
+# locked until commit (see inventory.py)
+conn_pool = db_pool.pool_from_env('product_db', init_command="SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+db_pool.init_app(app)
+
+
 def get_db_connection():
     try:
-        conn = mysql.connector.connect(
-            host=os.environ.get('DB_HOST', 'localhost'),
-            user=os.environ.get('DB_USER', 'user'),
-            password=os.environ.get('DB_PASSWORD', 'password'),
-            database=os.environ.get('DB_NAME', 'product_db')
-        )
-        return conn
-    except mysql.connector.Error as err:
+        return db_pool.borrow(conn_pool)
+    except (mysql.connector.Error, db_pool.PoolTimeout) as err:
         print(f"Error: {err}")
         return None
 
 
+# Product rows are cached per process; writers invalidate after commit
+cache = product_cache.cache_from_env(get_db_connection)
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'dbPool': conn_pool.stats(), 'auth': authenticator.stats(), 'productCache': cache.stats()}), 200
+
+
 def ensure_seed():
     """Insert sample products if table is empty. Idempotent."""
     try:
@@ -77,33 +91,180 @@ def ensure_seed():
 ensure_seed()
 
 
+# Upper bound on ids accepted by a single batch lookup (GET /products?ids=...)
+MAX_BATCH_IDS = int(os.environ.get('MAX_BATCH_IDS', '100'))
+
+
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'stock')
+PRODUCTS_DEFAULT_LIMIT = int(os.environ.get('PRODUCTS_PAGE_SIZE', '100'))
+PRODUCTS_MAX_LIMIT = 1000
+# Rows pulled from the unbuffered cursor (and written out) per step when streaming
+STREAM_FETCH_SIZE = int(os.environ.get('PRODUCTS_STREAM_FETCH_SIZE', '500'))
+
+
+def _columns(fields):
+    """Select list for `fields` of `products p`; stock is summed for striped products."""
+    return ', '.join(f"{inventory.STOCK_SQL} AS stock" if f == 'stock' else f for f in fields)
+
+
+def _etag(rows, *extra):
+    """Strong validator hashed from the row values (updated_at only has second
+    resolution, too coarse for stock changes), so no JSON is encoded for a 304.
+    """
+    h = hashlib.sha1()
+    for row in rows:
+        h.update(repr(sorted(row.items())).encode('utf-8'))
+    h.update(repr(extra).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _conditional(tag, body, headers=None):
+    """304 when If-None-Match already names `tag`, else `body()` as JSON; both carry the ETag."""
+    headers = dict(headers or {}, ETag=quote_etag(tag))
+    if request.if_none_match.contains_weak(tag):
+        return Response(status=304, headers=headers)
+    return jsonify(body()), 200, headers
+
+
+def _parse_fields(arg):
+    """Columns for ?fields=a,b (id is always included); None if a field is unknown."""
+    if not arg:
+        return list(PRODUCT_FIELDS)
+    wanted = [f.strip() for f in arg.split(',') if f.strip()]
+    if not wanted or any(f not in PRODUCT_FIELDS for f in wanted):
+        return None
+    return ['id'] + [f for f in dict.fromkeys(wanted) if f != 'id']
+
+
+def _stream_rows(conn, cursor, fmt):
+    """Write rows from an unbuffered cursor as a JSON array or NDJSON, one fetch at a time."""
+    dumps = lambda row: app.json.dumps(row, separators=(',', ':'))
+    try:
+        first = True
+        if fmt == 'json':
+            yield '['
+        while True:
+            rows = cursor.fetchmany(STREAM_FETCH_SIZE)
+            if not rows:
+                break
+            if fmt == 'ndjson':
+                yield ''.join(dumps(row) + '\n' for row in rows)
+            else:
+                yield ('' if first else ',') + ','.join(dumps(row) for row in rows)
+                first = False
+        if fmt == 'json':
+            yield ']'
+    finally:
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass  # unread rows after a client disconnect; the pool discards the connection
+        conn.close()
+
+
 @app.route('/api/v1/products', methods=['GET'])
 @require_auth
 def get_products():
+    """List products in id order, or look up a batch with ids=. fields=
+    projects columns. Passing limit or cursor pages the listing (limit rows,
+    next page cursor in X-Next-Cursor); without either every product is
+    returned, as before paging existed. stream=json|ndjson writes every
+    remaining row (up to limit, if given) incrementally from an unbuffered
+    cursor instead of building the response in memory.
+    """
+    fields = _parse_fields(request.args.get('fields'))
+    if fields is None:
+        return jsonify({'error': f"fields must be a subset of {','.join(PRODUCT_FIELDS)}"}), 400
+    columns = _columns(fields)
+    ids_arg = request.args.get('ids')
+    ids = None
+    if ids_arg is not None:
+        # Batch lookup: de-duplicate while keeping order, unknown ids are simply absent
+        ids = list(dict.fromkeys(i.strip() for i in ids_arg.split(',') if i.strip()))
+        if not ids:
+            return jsonify({'error': 'ids must not be empty'}), 400
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({'error': f'at most {MAX_BATCH_IDS} ids per request'}), 400
+        found = cache.get_many(ids)
+        missing = [i for i in ids if i not in found]
+        if missing:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
+            token = cache.token()
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ', '.join(['%s'] * len(missing))
+            cursor.execute(f"SELECT {_columns(PRODUCT_FIELDS)} FROM products p WHERE id IN ({placeholders})", tuple(missing))
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            cache.put_many(rows, token)
+            found.update((r['id'], r) for r in rows)
+        products = [{f: found[i][f] for f in fields} for i in ids if i in found]
+        return _conditional(_etag(products), lambda: products)
+
+    stream = request.args.get('stream')
+    if stream not in (None, 'json', 'ndjson'):
+        return jsonify({'error': 'stream must be json or ndjson'}), 400
+    cursor_arg = request.args.get('cursor')
+    limit = None
+    if request.args.get('limit') is not None or (cursor_arg and not stream):
+        try:
+            limit = min(max(int(request.args.get('limit', PRODUCTS_DEFAULT_LIMIT)), 1), PRODUCTS_MAX_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'invalid limit'}), 400
+    sql = f"SELECT {columns} FROM products p"
+    params = []
+    if cursor_arg:
+        decoded = _decode_cursor(cursor_arg, 'id')
+        if not decoded:
+            return jsonify({'error': 'invalid cursor'}), 400
+        sql += " WHERE id > %s"
+        params.append(decoded[1])
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit if stream else limit + 1)
+
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
+    if stream:
+        # Unbuffered: rows are read from the server as they are written out
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        cursor.execute(sql, tuple(params))
+        mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+        return Response(stream_with_context(_stream_rows(conn, cursor, stream)), mimetype=mimetype)
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT id, name, description, price, stock FROM products")
+    cursor.execute(sql, tuple(params))
     products = cursor.fetchall()
     cursor.close()
     conn.close()
-    return jsonify(products), 200
+    headers = {}
+    if limit is not None and len(products) > limit:
+        products = products[:limit]
+        headers['X-Next-Cursor'] = _encode_cursor('id', None, products[-1]['id'])
+    return _conditional(_etag(products, headers.get('X-Next-Cursor')), lambda: products, headers)
 
 
 @app.route('/api/v1/products/<string:product_id>', methods=['GET'])
 @require_auth
 def get_product(product_id):
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT id, name, description, price, stock FROM products WHERE id = %s", (product_id,))
-    product = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    product = cache.get(product_id)
+    if product is None:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+        token = cache.token()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT {_columns(PRODUCT_FIELDS)} FROM products p WHERE id = %s", (product_id,))
+        product = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if product:
+            cache.put(product, token)
     if product:
-        return jsonify(product), 200
+        return _conditional(_etag([product]), lambda: product)
     else:
         return jsonify({'error': 'Product not found'}), 404
 
@@ -142,6 +303,35 @@ def create_product():
     return jsonify({'id': pid}), 201
 
 
+# Change stock and return the new value in one statement: LAST_INSERT_ID(expr)
+# stores the updated stock in the session and the UPDATE's OK packet carries it
+# back as the insert id, so no follow-up SELECT (and no window for it to go stale).
+# Run as prepared statements kept per pooled connection (db_pool.execute_prepared).
+RESERVE_SQL = "UPDATE products SET stock = LAST_INSERT_ID(stock - %s) WHERE id = %s AND stock >= %s AND stock_buckets = 0"
+RELEASE_SQL = "UPDATE products SET stock = LAST_INSERT_ID(stock + %s) WHERE id = %s AND stock_buckets = 0"
+
+
+def _apply_stock(conn, sql, params, bucket_op, product_id, qty):
+    """Run RESERVE_SQL/RELEASE_SQL, or bucket_op (inventory.reserve/release)
+    for a striped product. Returns the new stock, or None if the product is
+    missing or short.
+    """
+    updated = conn.execute_prepared(sql, params)
+    if updated.rowcount:
+        return updated.lastrowid or 0
+    # Striped products keep their stock in buckets
+    buckets = inventory.buckets(conn, product_id)
+    if buckets is None:
+        return None
+    if buckets:
+        done = bucket_op(conn, product_id, qty, buckets)
+        if done is not None:
+            return inventory.bucket_stock(conn, product_id) if done else None
+    # Not striped (any more): a restripe to 0 may have committed since the first UPDATE
+    updated = conn.execute_prepared(sql, params)
+    return (updated.lastrowid or 0) if updated.rowcount else None
+
+
 @app.route('/api/v1/products/<string:product_id>/reserve', methods=['POST'])
 @require_auth
 def reserve_stock(product_id):
@@ -154,19 +344,13 @@ def reserve_stock(product_id):
         return jsonify({'error': 'Database connection failed'}), 500
     cursor = conn.cursor()
     try:
-        cursor.execute(
-            "UPDATE products SET stock = stock - %s WHERE id = %s AND stock >= %s",
-            (qty, product_id, qty)
-        )
-        if cursor.rowcount == 0:
+        new_stock = _apply_stock(conn, RESERVE_SQL, (qty, product_id, qty), inventory.reserve, product_id, qty)
+        if new_stock is None:
             conn.rollback()
             return jsonify({'error': 'Insufficient stock or product not found'}), 409
+        cache.record(cursor, [product_id])
         conn.commit()
-        # fetch new stock
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT stock FROM products WHERE id=%s", (product_id,))
-        row = cursor.fetchone()
-        new_stock = row['stock'] if row else None
+        cache.invalidate([product_id])
         return jsonify({'reserved': qty, 'stock': new_stock}), 200
     except mysql.connector.Error as err:
         conn.rollback()
@@ -191,18 +375,13 @@ def release_stock(product_id):
         return jsonify({'error': 'Database connection failed'}), 500
     cursor = conn.cursor()
     try:
-        cursor.execute(
-            "UPDATE products SET stock = stock + %s WHERE id = %s",
-            (qty, product_id)
-        )
-        if cursor.rowcount == 0:
+        new_stock = _apply_stock(conn, RELEASE_SQL, (qty, product_id), inventory.release, product_id, qty)
+        if new_stock is None:
             conn.rollback()
             return jsonify({'error': 'Product not found'}), 404
+        cache.record(cursor, [product_id])
         conn.commit()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT stock FROM products WHERE id=%s", (product_id,))
-        row = cursor.fetchone()
-        new_stock = row['stock'] if row else None
+        cache.invalidate([product_id])
         return jsonify({'released': qty, 'stock': new_stock}), 200
     except mysql.connector.Error as err:
         conn.rollback()
@@ -215,6 +394,164 @@ def release_stock(product_id):
         conn.close()
 
 
+def _parse_stock_lines(data):
+    """Validate a bulk reserve/release body and merge lines per product.
+    Returns (lines, error) where lines is [(product_id, quantity)] sorted by
+    product id, so row locks are always taken in the same order.
+    """
+    items = data.get('items')
+    if not isinstance(items, list) or len(items) == 0:
+        return None, 'items must be a non-empty array'
+    merged = {}
+    for it in items:
+        if not isinstance(it, dict) or 'productId' not in it or 'quantity' not in it:
+            return None, 'Each item requires productId and quantity'
+        try:
+            qty = int(it['quantity'])
+        except (ValueError, TypeError):
+            return None, 'quantity must be a positive integer'
+        if qty <= 0:
+            return None, 'quantity must be > 0'
+        pid = str(it['productId'])
+        merged[pid] = merged.get(pid, 0) + qty
+    if len(merged) > MAX_BATCH_IDS:
+        return None, f'at most {MAX_BATCH_IDS} distinct products per request'
+    return sorted(merged.items()), None
+
+
+def _stock_case_update(sign, lines):
+    """Single UPDATE applying a per-row delta: stock = stock +/- CASE id ... END."""
+    cases = ' '.join(['WHEN %s THEN %s'] * len(lines))
+    placeholders = ', '.join(['%s'] * len(lines))
+    sql = f"UPDATE products SET stock = stock {sign} CASE id {cases} END WHERE id IN ({placeholders})"
+    params = [v for pid, qty in lines for v in (pid, qty)] + [pid for pid, _ in lines]
+    return sql, tuple(params)
+
+
+def _lock_stock(cursor, lines):
+    """Lock the plain (unstriped) products of `lines` in id order and read their
+    stock. Striped products are read unlocked, as the sum of their buckets.
+    Returns (stock by id, bucket count by id of the striped products).
+    """
+    ids = [pid for pid, _ in lines]
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(
+        f"SELECT id, stock FROM products WHERE id IN ({placeholders}) AND stock_buckets = 0 ORDER BY id FOR UPDATE",
+        tuple(ids)
+    )
+    stock = {r['id']: r['stock'] for r in cursor.fetchall()}
+    striped = {}
+    rest = [pid for pid in ids if pid not in stock]
+    if rest:
+        cursor.execute(
+            f"SELECT id, stock_buckets, {inventory.STOCK_SQL} AS stock FROM products p "
+            f"WHERE id IN ({', '.join(['%s'] * len(rest))}) AND stock_buckets > 0",
+            tuple(rest)
+        )
+        for r in cursor.fetchall():
+            stock[r['id']] = r['stock']
+            striped[r['id']] = r['stock_buckets']
+    return stock, striped
+
+
+@app.route('/api/v1/products/reserve', methods=['POST'])
+@require_auth
+def reserve_stock_bulk():
+    """Reserve stock for several products in one transaction (all-or-nothing)."""
+    lines, err = _parse_stock_lines(request.get_json(silent=True) or {})
+    if err:
+        return jsonify({'error': err}), 400
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
+    try:
+        stock, striped = _lock_stock(cursor, lines)
+        results = []
+        for pid, qty in lines:
+            if pid not in stock:
+                results.append({'productId': pid, 'quantity': qty, 'status': 'NOT_FOUND'})
+            elif stock[pid] < qty:
+                results.append({'productId': pid, 'quantity': qty, 'status': 'INSUFFICIENT_STOCK', 'stock': stock[pid]})
+            else:
+                results.append({'productId': pid, 'quantity': qty, 'status': 'RESERVED', 'stock': stock[pid] - qty})
+        plain = [(pid, qty) for pid, qty in lines if pid not in striped]
+        if all(r['status'] == 'RESERVED' for r in results):
+            if plain:
+                cursor.execute(*_stock_case_update('-', plain))
+            # Striped stock was read unlocked; the bucket update is what decides
+            for r in results:
+                pid = r['productId']
+                if pid not in striped:
+                    continue
+                taken = inventory.reserve(conn, pid, r['quantity'], striped[pid])
+                if taken is None:
+                    # Restriped to 0 since it was read
+                    taken = conn.execute_prepared(RESERVE_SQL, (r['quantity'], pid, r['quantity'])).rowcount > 0
+                if not taken:
+                    r['status'] = 'INSUFFICIENT_STOCK'
+                    r['stock'] = stock[pid]
+                    break
+        if any(r['status'] != 'RESERVED' for r in results):
+            conn.rollback()
+            for r in results:
+                if r['status'] == 'RESERVED':
+                    r['status'] = 'NOT_RESERVED'
+                    r['stock'] = stock[r['productId']]
+            return jsonify({'error': 'Insufficient stock or product not found', 'items': results}), 409
+        cache.record(cursor, [pid for pid, _ in lines])
+        conn.commit()
+        cache.invalidate(pid for pid, _ in lines)
+        return jsonify({'reserved': True, 'items': results}), 200
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Failed to reserve stock: {err}'}), 500
+    finally:
+        cursor.close(); conn.close()
+
+
+@app.route('/api/v1/products/release', methods=['POST'])
+@require_auth
+def release_stock_bulk():
+    """Return stock for several products in one transaction.
+    Unknown products are reported per line; the rest are still released.
+    """
+    lines, err = _parse_stock_lines(request.get_json(silent=True) or {})
+    if err:
+        return jsonify({'error': err}), 400
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
+    try:
+        stock, striped = _lock_stock(cursor, lines)
+        for pid, qty in lines:
+            if pid in striped and inventory.release(conn, pid, qty, striped[pid]) is None:
+                # Restriped to 0 since it was read
+                if not conn.execute_prepared(RELEASE_SQL, (qty, pid)).rowcount:
+                    del stock[pid]
+        found = [(pid, qty) for pid, qty in lines if pid in stock]
+        plain = [(pid, qty) for pid, qty in found if pid not in striped]
+        if plain:
+            cursor.execute(*_stock_case_update('+', plain))
+        if found:
+            cache.record(cursor, [pid for pid, _ in found])
+        conn.commit()
+        cache.invalidate(pid for pid, _ in found)
+        results = []
+        for pid, qty in lines:
+            if pid in stock:
+                results.append({'productId': pid, 'quantity': qty, 'status': 'RELEASED', 'stock': stock[pid] + qty})
+            else:
+                results.append({'productId': pid, 'quantity': qty, 'status': 'NOT_FOUND'})
+        return jsonify({'released': len(found), 'items': results}), 200
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Failed to release stock: {err}'}), 500
+    finally:
+        cursor.close(); conn.close()
+
+
 @app.route('/api/v1/products/<string:product_id>', methods=['PUT'])
 @require_auth
 def update_product(product_id):
@@ -253,7 +590,11 @@ def update_product(product_id):
         if cursor.rowcount == 0:
             conn.rollback()
             return jsonify({'error': 'Product not found'}), 404
+        if 'stock' in fields:
+            inventory.restock(conn, product_id, fields['stock'])
+        cache.record(cursor, [product_id])
         conn.commit()
+        cache.invalidate([product_id])
         return jsonify({'updated': True}), 200
     except mysql.connector.Error as err:
         conn.rollback()
@@ -274,7 +615,9 @@ def delete_product(product_id):
         if cursor.rowcount == 0:
             conn.rollback()
             return jsonify({'error': 'Product not found'}), 404
+        cache.record(cursor, [product_id])
         conn.commit()
+        cache.invalidate([product_id])
         return jsonify({'deleted': True}), 200
     except mysql.connector.Error as err:
         conn.rollback()
@@ -283,39 +626,165 @@ def delete_product(product_id):
         cursor.close(); conn.close()
 
 
+@app.route('/api/v1/products/<string:product_id>/stock-buckets', methods=['PUT'])
+@require_auth
+def set_stock_buckets(product_id):
+    """Stripe a hot product's stock over `buckets` rows (0 folds it back into one)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        buckets = int(data.get('buckets'))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'buckets must be an integer'}), 400
+    if buckets < 0 or buckets > inventory.MAX_BUCKETS:
+        return jsonify({'error': f'buckets must be between 0 and {inventory.MAX_BUCKETS}'}), 400
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor()
+    try:
+        total = inventory.restripe(conn, product_id, buckets)
+        if total is None:
+            conn.rollback()
+            return jsonify({'error': 'Product not found'}), 404
+        cache.record(cursor, [product_id])
+        conn.commit()
+        cache.invalidate([product_id])
+        return jsonify({'buckets': buckets, 'stock': total}), 200
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Failed to set stock buckets: {err}'}), 500
+    finally:
+        cursor.close(); conn.close()
+
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# InnoDB FULLTEXT skips words shorter than innodb_ft_min_token_size and its
+# default stopwords; requiring one of those (+word) would match nothing
+SEARCH_MIN_TOKEN = int(os.environ.get('SEARCH_MIN_TOKEN', '3'))
+SEARCH_STOPWORDS = frozenset((
+    'a about an are as at be by com de en for from how i in is it la of on or '
+    'that the this to was what when where who will with und www'
+).split())
+
+
+def _fulltext_query(q):
+    """Boolean-mode query requiring every indexable word of q as a prefix, or None."""
+    words = re.findall(r'\w+', q.lower())  # also strips boolean operators
+    terms = [w for w in words if len(w) >= SEARCH_MIN_TOKEN and w not in SEARCH_STOPWORDS]
+    if not terms:
+        return None
+    return ' '.join(f'+{w}*' for w in terms)
+
+
+def _encode_cursor(mode, key, product_id):
+    raw = json.dumps({'m': mode, 'k': key, 'i': product_id}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor, mode):
+    """Inverse of _encode_cursor; returns (key, id) or None if malformed or from another mode."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        obj = json.loads(raw)
+        if obj['m'] != mode:
+            return None
+        return obj['k'], str(obj['i'])
+    except Exception:
+        return None
+
+
 @app.route('/api/v1/products/search', methods=['GET'])
 @require_auth
 def search_products():
+    """Search the catalog. With q, results are ranked by FULLTEXT relevance over
+    name and description (words of 1-2 letters fall back to a name prefix
+    match); without q they are ordered by price. minPrice/maxPrice use
+    idx_products_price. Passing limit or cursor pages the results (`limit`
+    rows, next page's cursor in the X-Next-Cursor header); without either
+    every match is returned.
+    """
     q = (request.args.get('q') or '').strip()
     min_price = request.args.get('minPrice')
     max_price = request.args.get('maxPrice')
+    limit = None
+    if request.args.get('limit') is not None or request.args.get('cursor'):
+        try:
+            limit = min(max(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'invalid limit'}), 400
     clauses = []
     params = []
-    if q:
-        clauses.append("name LIKE ?")
-        params.append(f"%{q}%")
     if min_price is not None:
         try:
-            clauses.append("price >= ?"); params.append(float(min_price))
+            clauses.append("price >= %s"); params.append(float(min_price))
         except ValueError:
             return jsonify({'error': 'invalid minPrice'}), 400
     if max_price is not None:
         try:
-            clauses.append("price <= ?"); params.append(float(max_price))
+            clauses.append("price <= %s"); params.append(float(max_price))
         except ValueError:
             return jsonify({'error': 'invalid maxPrice'}), 400
+
+    ft_query = _fulltext_query(q) if q else None
+    select = f"SELECT {_columns(PRODUCT_FIELDS)}"
+    having = ""
+    having_params = []
+    if ft_query:
+        mode, sort_col = 'score', 'score'
+        # Rounded so the cursor's copy of the score compares equal in the seek
+        select += ", ROUND(MATCH(name, description) AGAINST (%s IN BOOLEAN MODE), 6) AS score"
+        clauses.insert(0, "MATCH(name, description) AGAINST (%s IN BOOLEAN MODE)")
+        params.insert(0, ft_query)
+        params.insert(0, ft_query)
+        order = " ORDER BY score DESC, id ASC"
+    elif q:
+        # Escape LIKE wildcards so the prefix match stays an index range on name
+        mode, sort_col = 'name', 'name'
+        clauses.insert(0, "name LIKE %s")
+        params.insert(0, re.sub(r'([%_\\])', r'\\\1', q) + '%')
+        order = " ORDER BY name ASC, id ASC"
+    else:
+        mode, sort_col = 'price', 'price'
+        order = " ORDER BY price ASC, id ASC"
+
+    cursor_arg = request.args.get('cursor')
+    if cursor_arg:
+        decoded = _decode_cursor(cursor_arg, mode)
+        if not decoded:
+            return jsonify({'error': 'invalid cursor'}), 400
+        key, last_id = decoded
+        if mode == 'score':
+            # Relevance is computed per row, so the seek goes in HAVING
+            having = " HAVING score < %s OR (score = %s AND id > %s)"
+            having_params = [float(key), float(key), last_id]
+        else:
+            # Leading `col >= key` keeps the seek a range scan on the index
+            clauses.append(f"{sort_col} >= %s AND ({sort_col} > %s OR id > %s)")
+            params.extend([key, key, last_id])
+
     where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
-    sql = "SELECT id, name, description, price, stock FROM products" + where
+    sql = select + " FROM products p" + where + having + order
+    params = params + having_params
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit + 1)
     conn = get_db_connection();
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
-    # mysql-connector uses %s placeholders, fix placeholders
-    sql = sql.replace('?', '%s')
     cursor = conn.cursor(dictionary=True)
     cursor.execute(sql, tuple(params))
     rows = cursor.fetchall()
     cursor.close(); conn.close()
-    return jsonify(rows), 200
+
+    headers = {}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers['X-Next-Cursor'] = _encode_cursor(mode, last[sort_col], last['id'])
+    for row in rows:
+        row.pop('score', None)
+    return jsonify(rows), 200, headers
 
 
 if __name__ == '__main__':
@@ -331,5 +800,6 @@ if __name__ == '__main__':
         raise SystemExit(0)
     signal.signal(signal.SIGTERM, _graceful)
     signal.signal(signal.SIGINT, _graceful)
+    cache.start()
     port = int(os.environ.get('FLASK_RUN_PORT', 8081))
     app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
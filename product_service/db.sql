@@ -7,6 +7,7 @@ CREATE TABLE IF NOT EXISTS products (
     description TEXT,
     price DECIMAL(10, 2) NOT NULL,
     stock INT NOT NULL,
+    stock_buckets SMALLINT NOT NULL DEFAULT 0,
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     CONSTRAINT chk_price_nonneg CHECK (price >= 0),
@@ -14,6 +15,24 @@ CREATE TABLE IF NOT EXISTS products (
 );
 
 CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
+CREATE INDEX IF NOT EXISTS idx_products_price ON products(price, id);
+CREATE FULLTEXT INDEX IF NOT EXISTS ft_products_name_description ON products(name, description);
+
+CREATE TABLE IF NOT EXISTS product_invalidations (
+    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+    product_id VARCHAR(36) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_product_invalidations_created (created_at)
+);
+
+CREATE TABLE IF NOT EXISTS product_stock_buckets (
+    product_id VARCHAR(36) NOT NULL,
+    bucket SMALLINT NOT NULL,
+    stock INT NOT NULL,
+    PRIMARY KEY (product_id, bucket),
+    CONSTRAINT fk_stock_buckets_product FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    CONSTRAINT chk_bucket_stock_nonneg CHECK (stock >= 0)
+);
 
 INSERT INTO products (id, name, description, price, stock) VALUES
 (UUID(), 'Laptop', 'A powerful and portable laptop.', 1200.00, 50),
@@ -0,0 +1,177 @@
+"""Striped stock for hot products.
+
+A product with stock_buckets = N > 0 keeps its stock in N rows of
+product_stock_buckets instead of products.stock (held at 0). Concurrent
+reservations for it then lock different rows, so reserve throughput on a hot
+SKU grows with N instead of queueing on one row lock.
+
+A reservation takes the whole quantity from one random bucket. If that
+bucket is short, it retries on the fullest bucket. If no single bucket can
+cover the quantity, it locks the products row and then every bucket of the
+product in bucket order, and spreads what is left evenly across them
+(rebalancing). Releases add to a random bucket. Reads report the sum of the
+buckets (STOCK_SQL).
+
+restripe() can change or remove a product's buckets between the caller's
+read of stock_buckets and the update. Whenever the bucket path comes up
+empty, it therefore re-reads stock_buckets under the products row lock (the
+lock restripe() holds), using the same products-then-buckets order. If the
+product is no longer striped, reserve() and release() return None and the
+caller retries on products.stock.
+
+product_service connections run at READ COMMITTED, so a conditional UPDATE
+that finds its bucket short releases that row at once rather than holding
+it until commit. Only concurrent rebalances of the same product therefore
+wait on each other.
+
+All functions take the caller's pooled connection and run inside its
+transaction; the single-bucket updates use its reusable prepared statements.
+"""
+import random
+
+MAX_BUCKETS = 64
+
+# Stock of the products row aliased `p`, summed over its buckets when striped
+STOCK_SQL = (
+    "(CASE WHEN p.stock_buckets > 0 THEN "
+    "(SELECT CAST(COALESCE(SUM(b.stock), 0) AS SIGNED) FROM product_stock_buckets b WHERE b.product_id = p.id) "
+    "ELSE p.stock END)"
+)
+
+
+def _even(total, n):
+    return [total // n + (1 if i < total % n else 0) for i in range(n)]
+
+
+TAKE_SQL = "UPDATE product_stock_buckets SET stock = stock - %s WHERE product_id = %s AND bucket = %s AND stock >= %s"
+GIVE_SQL = "UPDATE product_stock_buckets SET stock = stock + %s WHERE product_id = %s AND bucket = %s"
+
+
+def _take(conn, product_id, bucket, qty):
+    return conn.execute_prepared(TAKE_SQL, (qty, product_id, bucket, qty)).rowcount > 0
+
+
+def _fill(cur, product_id, total, n):
+    # Replace the product's buckets with n rows holding `total` between them
+    cur.execute("DELETE FROM product_stock_buckets WHERE product_id = %s", (product_id,))
+    if n:
+        rows = [(product_id, i, s) for i, s in enumerate(_even(total, n))]
+        cur.execute(
+            f"INSERT INTO product_stock_buckets (product_id, bucket, stock) VALUES {', '.join(['(%s, %s, %s)'] * n)}",
+            tuple(v for row in rows for v in row)
+        )
+
+
+def buckets(conn, product_id, lock=False):
+    """stock_buckets of a product (0 when not striped), or None if it does not exist.
+    lock=True holds the products row until commit, so it cannot be restriped meanwhile.
+    """
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute(
+            "SELECT stock_buckets FROM products WHERE id = %s" + (" FOR UPDATE" if lock else ""),
+            (product_id,)
+        )
+        row = cur.fetchone()
+        return int(row[0]) if row else None
+    finally:
+        cur.close()
+
+
+def bucket_stock(conn, product_id):
+    """Summed stock of a striped product."""
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute("SELECT COALESCE(SUM(stock), 0) FROM product_stock_buckets WHERE product_id = %s", (product_id,))
+        return int(cur.fetchone()[0])
+    finally:
+        cur.close()
+
+
+def reserve(conn, product_id, qty, n):
+    """Take qty from a product striped over n buckets. Returns True when taken,
+    False if its summed stock is short, None if it is no longer striped.
+    """
+    if n <= 0:
+        return None
+    if _take(conn, product_id, random.randrange(n), qty):
+        return True
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute(
+            "SELECT bucket FROM product_stock_buckets WHERE product_id = %s AND stock >= %s ORDER BY stock DESC LIMIT 1",
+            (product_id, qty)
+        )
+        row = cur.fetchone()
+        if row and _take(conn, product_id, row[0], qty):
+            return True
+        # No single bucket covers qty: hold the product, then lock its buckets and rebalance
+        n = buckets(conn, product_id, lock=True)
+        if not n:
+            return None
+        cur.execute(
+            "SELECT stock FROM product_stock_buckets WHERE product_id = %s ORDER BY bucket FOR UPDATE",
+            (product_id,)
+        )
+        total = sum(r[0] for r in cur.fetchall())
+        if total < qty:
+            return False
+        _fill(cur, product_id, total - qty, n)
+        return True
+    finally:
+        cur.close()
+
+
+def release(conn, product_id, qty, n):
+    """Return qty to a random bucket. Returns True, or None if the product is
+    no longer striped (or no longer exists).
+    """
+    if n > 0 and conn.execute_prepared(GIVE_SQL, (qty, product_id, random.randrange(n))).rowcount > 0:
+        return True
+    # Restriped since n was read: retry against the buckets it has now
+    n = buckets(conn, product_id, lock=True)
+    if not n:
+        return None
+    conn.execute_prepared(GIVE_SQL, (qty, product_id, random.randrange(n)))
+    return True
+
+
+def restripe(conn, product_id, n):
+    """Move a product's stock into n buckets (n = 0 folds it back into products.stock).
+    Returns the total stock moved, or None if the product does not exist.
+    """
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute("SELECT stock, stock_buckets FROM products WHERE id = %s FOR UPDATE", (product_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        total, current = int(row[0]), int(row[1])
+        if current:
+            cur.execute(
+                "SELECT stock FROM product_stock_buckets WHERE product_id = %s ORDER BY bucket FOR UPDATE",
+                (product_id,)
+            )
+            total = sum(r[0] for r in cur.fetchall())
+        _fill(cur, product_id, total, n)
+        cur.execute(
+            "UPDATE products SET stock = %s, stock_buckets = %s WHERE id = %s",
+            (0 if n else total, n, product_id)
+        )
+        return total
+    finally:
+        cur.close()
+
+
+def restock(conn, product_id, total):
+    """After products.stock was set to `total`, move it into the buckets if the product is striped."""
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute("SELECT stock_buckets FROM products WHERE id = %s FOR UPDATE", (product_id,))
+        row = cur.fetchone()
+        n = int(row[0]) if row else 0
+        if n:
+            _fill(cur, product_id, total, n)
+            cur.execute("UPDATE products SET stock = 0 WHERE id = %s", (product_id,))
+    finally:
+        cur.close()
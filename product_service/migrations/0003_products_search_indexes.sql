@@ -0,0 +1,18 @@
+-- Indexes for GET /products/search:
+-- FULLTEXT over name+description for relevance-ranked matching, and
+-- (price, id) for price-range filters and the price-ordered keyset seek
+USE product_db;
+
+SET @idx_exists = (
+  SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND INDEX_NAME = 'ft_products_name_description'
+);
+SET @stmt = IF(@idx_exists > 0, 'SELECT 1', 'CREATE FULLTEXT INDEX ft_products_name_description ON products(name, description)');
+PREPARE s FROM @stmt; EXECUTE s; DEALLOCATE PREPARE s;
+
+SET @idx_exists = (
+  SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND INDEX_NAME = 'idx_products_price'
+);
+SET @stmt = IF(@idx_exists > 0, 'SELECT 1', 'CREATE INDEX idx_products_price ON products(price, id)');
+PREPARE s FROM @stmt; EXECUTE s; DEALLOCATE PREPARE s;
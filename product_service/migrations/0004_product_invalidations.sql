@@ -0,0 +1,10 @@
+-- Cross-replica product cache invalidations (PRODUCT_CACHE_SYNC_INTERVAL > 0):
+-- writers append changed ids in their transaction, every replica polls by seq
+USE product_db;
+
+CREATE TABLE IF NOT EXISTS product_invalidations (
+    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+    product_id VARCHAR(36) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_product_invalidations_created (created_at)
+);
@@ -0,0 +1,19 @@
+-- Striped inventory for hot products: with stock_buckets = N > 0 the stock
+-- lives in N product_stock_buckets rows (summed on read) and products.stock is 0
+USE product_db;
+
+SET @col_exists = (
+  SELECT COUNT(1) FROM INFORMATION_SCHEMA.COLUMNS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'products' AND COLUMN_NAME = 'stock_buckets'
+);
+SET @stmt = IF(@col_exists > 0, 'SELECT 1', 'ALTER TABLE products ADD COLUMN stock_buckets SMALLINT NOT NULL DEFAULT 0');
+PREPARE s FROM @stmt; EXECUTE s; DEALLOCATE PREPARE s;
+
+CREATE TABLE IF NOT EXISTS product_stock_buckets (
+    product_id VARCHAR(36) NOT NULL,
+    bucket SMALLINT NOT NULL,
+    stock INT NOT NULL,
+    PRIMARY KEY (product_id, bucket),
+    CONSTRAINT fk_stock_buckets_product FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+    CONSTRAINT chk_bucket_stock_nonneg CHECK (stock >= 0)
+);
@@ -0,0 +1,207 @@
+"""Read cache for single product rows.
+
+get_product and the ids= batch lookup serve rows from a per-process LRU
+bounded to max_entries. Each entry expires after ttl seconds. Handlers that
+change a product (update, delete, reserve, release, bulk reserve/release)
+invalidate its entry after they commit. A lookup that read the database
+before such an invalidation cannot store its result afterwards, because
+put() is rejected once the generation has moved on. Misses are not cached,
+so a new product is visible at once.
+
+Other replicas learn about changes only when the ttl expires, unless the
+invalidation channel is enabled (sync_interval > 0). In that mode, writers
+also insert the changed ids into product_invalidations in the same
+transaction. Every replica polls that table and drops the listed entries.
+Sequence gaps left by transactions that were still open are re-checked for
+gap_seconds, so a late commit is not missed. Rows older than retention
+seconds are pruned.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProductCache:
+    def __init__(self, max_entries=10000, ttl=30.0, connect=None, sync_interval=0.0,
+                 retention=300.0, gap_seconds=10.0, batch_size=1000):
+        # 0 disables the cache
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.connect = connect
+        self.sync_interval = float(sync_interval) if connect else 0.0
+        self.retention = float(retention)
+        self.gap_seconds = float(gap_seconds)
+        self.batch_size = int(batch_size)
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0,
+                       'syncPolls': 0, 'syncInvalidations': 0, 'syncErrors': 0}
+        self._last_seq = None
+        self._gaps = {}
+        self._last_prune = 0.0
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def token(self):
+        """Take before reading the database; pass to put() with the row read."""
+        with self._lock:
+            return self._generation
+
+    def get_many(self, ids):
+        """Cached rows for ids as {id: row}; ids not returned must be read from the database."""
+        if not self.enabled:
+            return {}
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for pid in ids:
+                entry = self._entries.get(pid)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(pid)
+                    found[pid] = entry[0]
+                    continue
+                if entry is not None:
+                    del self._entries[pid]
+                    self._stats['stale'] += 1
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(ids) - len(found)
+        return found
+
+    def get(self, product_id):
+        return self.get_many([product_id]).get(product_id)
+
+    def put_many(self, rows, token):
+        """Store rows read from the database, unless an invalidation happened since token()."""
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            if token != self._generation:
+                return
+            for row in rows:
+                self._entries[row['id']] = (dict(row), expires_at)
+                self._entries.move_to_end(row['id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def put(self, row, token):
+        self.put_many([row], token)
+
+    def _drop(self, ids, counter):
+        with self._lock:
+            self._generation += 1
+            for pid in ids:
+                self._entries.pop(pid, None)
+            self._stats[counter] += len(ids)
+
+    def invalidate(self, ids):
+        """Drop changed products; call after the change is committed."""
+        if self.enabled:
+            self._drop(list(ids), 'invalidations')
+
+    def record(self, cursor, ids):
+        """Publish changed ids to other replicas in the caller's transaction (no-op unless syncing)."""
+        if not self.sync_interval or not ids:
+            return
+        cursor.execute(
+            f"INSERT INTO product_invalidations (product_id) VALUES {', '.join(['(%s)'] * len(ids))}",
+            tuple(ids)
+        )
+
+    def sync_once(self):
+        """Apply invalidations committed since the last poll; returns how many rows were read."""
+        conn = self.connect()
+        if not conn:
+            raise RuntimeError('Database connection failed')
+        cur = conn.cursor()
+        try:
+            if self._last_seq is None:
+                # Start from the current end; anything older predates our entries
+                cur.execute("SELECT COALESCE(MAX(seq), 0) FROM product_invalidations")
+                self._last_seq = int(cur.fetchone()[0])
+                return 0
+            now = time.monotonic()
+            self._gaps = {s: t for s, t in self._gaps.items() if t > now}
+            sql = "SELECT seq, product_id FROM product_invalidations WHERE seq > %s"
+            params = [self._last_seq]
+            if self._gaps:
+                sql += f" OR seq IN ({', '.join(['%s'] * len(self._gaps))})"
+                params += list(self._gaps)
+            sql += " ORDER BY seq LIMIT %s"
+            params.append(self.batch_size)
+            cur.execute(sql, tuple(params))
+            rows = cur.fetchall()
+            for seq, _ in rows:
+                seq = int(seq)
+                if seq in self._gaps:
+                    del self._gaps[seq]
+                    continue
+                # Ids skipped here may belong to transactions that have not committed yet
+                for missing in range(self._last_seq + 1, min(seq, self._last_seq + 1 + self.batch_size)):
+                    self._gaps[missing] = now + self.gap_seconds
+                self._last_seq = max(self._last_seq, seq)
+            if rows:
+                self._drop({pid for _, pid in rows}, 'syncInvalidations')
+            if now - self._last_prune > self.retention:
+                self._last_prune = now
+                cur.execute(
+                    "DELETE FROM product_invalidations WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT 10000",
+                    (int(self.retention),)
+                )
+            conn.commit()
+            return len(rows)
+        finally:
+            cur.close()
+            conn.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                read = self.sync_once()
+                with self._lock:
+                    self._stats['syncPolls'] += 1
+            except Exception as e:
+                read = 0
+                with self._lock:
+                    self._stats['syncErrors'] += 1
+                print(f"product cache sync error: {e}")
+            if read < self.batch_size:
+                self._stopping.wait(self.sync_interval)
+
+    def start(self):
+        """Start polling for other replicas' invalidations (no-op unless syncing)."""
+        if not self.enabled or not self.sync_interval:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='product-cache-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['entries'] = len(self._entries)
+            out['gaps'] = len(self._gaps)
+        lookups = out['hits'] + out['misses']
+        out['hitRatio'] = round(out['hits'] / lookups, 4) if lookups else None
+        out.update({'maxEntries': self.max_entries, 'ttl': self.ttl, 'sync': bool(self.enabled and self.sync_interval)})
+        return out
+
+
+def cache_from_env(connect):
+    return ProductCache(
+        max_entries=int(os.environ.get('PRODUCT_CACHE_SIZE', '10000')),
+        ttl=float(os.environ.get('PRODUCT_CACHE_TTL', '30')),
+        connect=connect,
+        sync_interval=float(os.environ.get('PRODUCT_CACHE_SYNC_INTERVAL', '0')),
+        retention=float(os.environ.get('PRODUCT_CACHE_SYNC_RETENTION', '300')),
+    )
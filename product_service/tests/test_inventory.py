@@ -0,0 +1,96 @@
+import pytest
+
+import fake_mysql
+import inventory
+
+SCHEMA = """
+    CREATE TABLE products (id TEXT PRIMARY KEY, stock INT NOT NULL, stock_buckets INT NOT NULL DEFAULT 0);
+    CREATE TABLE product_stock_buckets (
+        product_id TEXT NOT NULL, bucket INT NOT NULL, stock INT NOT NULL CHECK (stock >= 0),
+        PRIMARY KEY (product_id, bucket)
+    );
+    INSERT INTO products (id, stock) VALUES ('p', 100);
+"""
+
+
+@pytest.fixture
+def conn(tmp_path):
+    return fake_mysql.Database(tmp_path / 'product.db', SCHEMA).connect()
+
+
+def bucket_rows(conn):
+    return conn.raw.execute("SELECT bucket, stock FROM product_stock_buckets ORDER BY bucket").fetchall()
+
+
+def product_row(conn):
+    return conn.raw.execute("SELECT stock, stock_buckets FROM products WHERE id = 'p'").fetchone()
+
+
+def test_restripe_spreads_stock_evenly(conn):
+    assert inventory.restripe(conn, 'p', 3) == 100
+    assert bucket_rows(conn) == [(0, 34), (1, 33), (2, 33)]
+    assert product_row(conn) == (0, 3)
+    assert inventory.buckets(conn, 'p') == 3
+    assert inventory.buckets(conn, 'missing') is None
+
+
+def test_restripe_to_zero_folds_back(conn):
+    inventory.restripe(conn, 'p', 4)
+    inventory.reserve(conn, 'p', 10, 4)
+    assert inventory.restripe(conn, 'p', 0) == 90
+    assert product_row(conn) == (90, 0)
+    assert bucket_rows(conn) == []
+
+
+def test_reserve_takes_from_one_bucket(conn):
+    inventory.restripe(conn, 'p', 4)
+    for _ in range(10):
+        assert inventory.reserve(conn, 'p', 3, 4) is True
+    assert inventory.bucket_stock(conn, 'p') == 70
+    assert all(stock >= 0 for _, stock in bucket_rows(conn))
+
+
+def test_reserve_rebalances_when_no_bucket_covers(conn):
+    inventory.restripe(conn, 'p', 4)
+    # 25 per bucket: 40 only fits after pooling them
+    assert inventory.reserve(conn, 'p', 40, 4) is True
+    assert bucket_rows(conn) == [(0, 15), (1, 15), (2, 15), (3, 15)]
+
+
+def test_reserve_short_leaves_stock(conn):
+    inventory.restripe(conn, 'p', 4)
+    assert inventory.reserve(conn, 'p', 101, 4) is False
+    assert inventory.bucket_stock(conn, 'p') == 100
+
+
+def test_release_adds_to_a_bucket(conn):
+    inventory.restripe(conn, 'p', 4)
+    assert inventory.release(conn, 'p', 7, 4) is True
+    assert inventory.bucket_stock(conn, 'p') == 107
+
+
+def test_stale_bucket_count_after_unstripe(conn):
+    inventory.restripe(conn, 'p', 4)
+    inventory.restripe(conn, 'p', 0)
+    # Caller read stock_buckets = 4 before the restripe committed
+    assert inventory.reserve(conn, 'p', 5, 4) is None
+    assert inventory.release(conn, 'p', 5, 4) is None
+    assert product_row(conn) == (100, 0)
+
+
+def test_stale_bucket_count_after_restripe_to_fewer(conn):
+    inventory.restripe(conn, 'p', 4)
+    inventory.restripe(conn, 'p', 2)
+    assert inventory.reserve(conn, 'p', 60, 4) is True
+    # Rebalanced over the two buckets the product has now, not the four it had
+    assert bucket_rows(conn) == [(0, 20), (1, 20)]
+    assert inventory.release(conn, 'p', 1, 4) is True
+    assert inventory.bucket_stock(conn, 'p') == 41
+
+
+def test_restock_refills_buckets(conn):
+    inventory.restripe(conn, 'p', 2)
+    conn.raw.execute("UPDATE products SET stock = 11 WHERE id = 'p'")
+    inventory.restock(conn, 'p', 11)
+    assert bucket_rows(conn) == [(0, 6), (1, 5)]
+    assert product_row(conn) == (0, 2)
@@ -1,31 +1,48 @@
 import os
 import uuid
 import mysql.connector
+import auth_cache
+import db_pool
+import hashing
 import datetime
+import hashlib
+import hmac
+import secrets
 import jwt
 from flask import Flask, request, jsonify
 import coverage as _coverage
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 
 app = Flask(__name__)
 JWT_SECRET = os.environ.get('JWT_SECRET', 'dev-secret-change-me')
 JWT_ALG = 'HS256'
-# Default JWT TTL to 30 days; allow override via env (seconds)
+# Default JWT TTL to 30 days; allow override via env (seconds). Deployments whose
+# clients use refresh tokens should opt into short-lived access tokens (e.g. 900)
 JWT_TTL_SECONDS = int(os.environ.get('JWT_TTL_SECONDS', str(30 * 24 * 60 * 60)))
+# Refresh tokens last 30 days by default (seconds)
+REFRESH_TOKEN_TTL_SECONDS = int(os.environ.get('REFRESH_TOKEN_TTL_SECONDS', str(30 * 24 * 60 * 60)))
+# Key for the refresh-token digests stored in the DB
+REFRESH_TOKEN_SECRET = os.environ.get('REFRESH_TOKEN_SECRET', JWT_SECRET)
 
 # Auth helpers (must be defined before route decorators)
 from functools import wraps
 
+# PBKDF2 runs in a bounded process pool; overload answers 503 instead of queueing
+hash_pool = hashing.pool_from_env()
+
+
+def _hash_overloaded(err):
+    print(f"Password hashing overloaded: {err}")
+    return jsonify({'error': 'Authentication service busy, retry shortly'}), 503, {'Retry-After': '1'}
+
+
+# Verified tokens are cached per process until they expire
+authenticator = auth_cache.authenticator_from_env(JWT_SECRET, JWT_ALG)
+
+
 def _get_auth_user_id():
-    auth = request.headers.get('Authorization') or ''
-    if not auth.startswith('Bearer '):
-        return None
-    token = auth.split(' ', 1)[1].strip()
-    try:
-        decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return decoded.get('sub')
-    except Exception:
-        return None
+    claims = authenticator.claims(request.headers)
+    return claims.get('sub') if claims else None
 
 
 def require_auth(fn):
@@ -38,6 +55,19 @@ def require_auth(fn):
     return wrapper
 
 
+# Pooled connections: close() hands the connection back instead of disconnecting
+conn_pool = db_pool.pool_from_env('user_db')
+db_pool.init_app(app)
+
+
+def get_db_connection():
+    try:
+        return db_pool.borrow(conn_pool)
+    except (mysql.connector.Error, db_pool.PoolTimeout) as err:
+        print(f"Error: {err}")
+        return None
+
+
 def ensure_seed_user():
     """Ensure a default admin user exists; create if missing.
     Uses ADMIN_USERNAME/ADMIN_EMAIL/ADMIN_PASSWORD env vars or defaults.
@@ -77,22 +107,15 @@ def ensure_seed_user():
         pass
 
 
-# Seed default admin on startup (only if users table is empty)
-ensure_seed_user()
+# Seed default admin on startup (only if users table is empty); hash workers
+# import this module as __mp_main__ and skip it
+if __name__ != '__mp_main__':
+    ensure_seed_user()
 
 
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(
-            host=os.environ.get('DB_HOST', 'localhost'),
-            user=os.environ.get('DB_USER', 'user'),
-            password=os.environ.get('DB_PASSWORD', 'password'),
-            database=os.environ.get('DB_NAME', 'user_db')
-        )
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Error: {err}")
-        return None
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'dbPool': conn_pool.stats(), 'auth': authenticator.stats(), 'hashing': hash_pool.stats()}), 200
 
 
 @app.route('/api/v1/users', methods=['POST'])
@@ -112,6 +135,12 @@ def create_user():
     if len(password) < 6:
         return jsonify({'error': 'password too short'}), 400
 
+    # Hash before borrowing a DB connection so a slow hash doesn't hold one
+    try:
+        password_hash = hash_pool.generate(password)
+    except hashing.Overloaded as err:
+        return _hash_overloaded(err)
+
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
@@ -119,7 +148,6 @@ def create_user():
     cursor = conn.cursor()
     user_id = str(uuid.uuid4())
     try:
-        password_hash = generate_password_hash(password)
         cursor.execute(
             "INSERT INTO users (id, username, email, password_hash, phone) VALUES (%s, %s, %s, %s, %s)",
             (user_id, username, email, password_hash, phone)
@@ -174,8 +202,9 @@ def delete_user(user_id):
             cur.close(); conn.close()
             return jsonify({'error': 'User not found'}), 404
 
-        # Delete addresses first to satisfy FK constraints
+        # Delete addresses and refresh tokens first to satisfy FK constraints
         cur.execute("DELETE FROM addresses WHERE user_id=%s", (user_id,))
+        cur.execute("DELETE FROM refresh_tokens WHERE user_id=%s", (user_id,))
         # Delete user
         cur.execute("DELETE FROM users WHERE id=%s", (user_id,))
         conn.commit()
@@ -295,6 +324,31 @@ def delete_address(user_id, addr_id):
     return jsonify({'deleted': True}), 200
 
 
+def _issue_access_token(user_id, username):
+    now = datetime.datetime.utcnow()
+    payload = {
+        'sub': user_id,
+        'username': username,
+        'iat': int(now.timestamp()),
+        'exp': int((now + datetime.timedelta(seconds=JWT_TTL_SECONDS)).timestamp())
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
+
+
+def _refresh_digest(token):
+    return hmac.new(REFRESH_TOKEN_SECRET.encode('utf-8'), token.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _store_refresh_token(cursor, user_id):
+    """Insert a new refresh token for user_id and return it; only its digest is stored."""
+    token = secrets.token_urlsafe(32)
+    cursor.execute(
+        "INSERT INTO refresh_tokens (token_hash, user_id, expires_at) VALUES (%s, %s, UTC_TIMESTAMP() + INTERVAL %s SECOND)",
+        (_refresh_digest(token), user_id, REFRESH_TOKEN_TTL_SECONDS)
+    )
+    return token
+
+
 @app.route('/api/v1/login', methods=['POST'])
 def login():
     data = request.get_json() or {}
@@ -308,19 +362,133 @@ def login():
     row = cursor.fetchone()
     cursor.close()
     conn.close()
-    if not row or not check_password_hash(row['password_hash'], data['password']):
+    if not row:
+        return jsonify({'error': 'Invalid credentials'}), 401
+    try:
+        valid = hash_pool.check(row['password_hash'], data['password'])
+    except hashing.Overloaded as err:
+        return _hash_overloaded(err)
+    if not valid:
         return jsonify({'error': 'Invalid credentials'}), 401
-    # issue JWT (expires in 30 days by default)
-    now = datetime.datetime.utcnow()
-    payload = {
-        'sub': row['id'],
-        'username': row['username'],
-        'iat': int(now.timestamp()),
-        'exp': int((now + datetime.timedelta(seconds=JWT_TTL_SECONDS)).timestamp())
-    }
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
-    return jsonify({'id': row['id'], 'username': row['username'], 'email': row['email'], 'token': token}), 200
 
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor()
+    try:
+        # Drop this user's expired tokens while we're here
+        cursor.execute("DELETE FROM refresh_tokens WHERE user_id=%s AND expires_at <= UTC_TIMESTAMP()", (row['id'],))
+        refresh_token = _store_refresh_token(cursor, row['id'])
+        conn.commit()
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Failed to create session: {err}'}), 500
+    finally:
+        cursor.close()
+        conn.close()
+    token = _issue_access_token(row['id'], row['username'])
+    return jsonify({
+        'id': row['id'],
+        'username': row['username'],
+        'email': row['email'],
+        'token': token,
+        'expiresIn': JWT_TTL_SECONDS,
+        'refreshToken': refresh_token,
+    }), 200
+
+
+@app.route('/api/v1/token/refresh', methods=['POST'])
+def refresh_access_token():
+    """Exchange a refresh token for a new access token and a new refresh token.
+    The presented token is revoked (rotation); presenting a rotated-out token
+    again revokes every refresh token of that user.
+    """
+    data = request.get_json(silent=True) or {}
+    presented = data.get('refreshToken')
+    if not isinstance(presented, str) or not presented:
+        return jsonify({'error': 'refreshToken is required'}), 400
+    digest = _refresh_digest(presented)
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            "SELECT r.user_id, r.revoked_at, r.replaced_by, r.expires_at > UTC_TIMESTAMP() AS live, u.username "
+            "FROM refresh_tokens r JOIN users u ON u.id = r.user_id WHERE r.token_hash=%s FOR UPDATE",
+            (digest,)
+        )
+        row = cursor.fetchone()
+        if not row or not row['live'] or (row['revoked_at'] is not None and row['replaced_by'] is None):
+            conn.rollback()
+            return jsonify({'error': 'Invalid refresh token'}), 401
+        if row['revoked_at'] is not None:
+            # Reuse of a rotated token means it leaked; end all of the user's sessions
+            cursor.execute(
+                "UPDATE refresh_tokens SET revoked_at=UTC_TIMESTAMP() WHERE user_id=%s AND revoked_at IS NULL",
+                (row['user_id'],)
+            )
+            conn.commit()
+            print(f"Refresh token reuse for user {row['user_id']}; revoked all sessions")
+            return jsonify({'error': 'Invalid refresh token'}), 401
+        refresh_token = _store_refresh_token(cursor, row['user_id'])
+        cursor.execute(
+            "UPDATE refresh_tokens SET revoked_at=UTC_TIMESTAMP(), replaced_by=%s WHERE token_hash=%s",
+            (_refresh_digest(refresh_token), digest)
+        )
+        conn.commit()
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Failed to refresh token: {err}'}), 500
+    finally:
+        cursor.close()
+        conn.close()
+    token = _issue_access_token(row['user_id'], row['username'])
+    return jsonify({
+        'id': row['user_id'],
+        'token': token,
+        'expiresIn': JWT_TTL_SECONDS,
+        'refreshToken': refresh_token,
+    }), 200
+
+
+@app.route('/api/v1/token/revoke', methods=['POST'])
+def revoke_refresh_token():
+    """Revoke a refresh token (logout), or with {"all": true} every refresh
+    token of its user. The answer is the same whether or not the token was
+    live, so it can't be used to probe tokens.
+    """
+    data = request.get_json(silent=True) or {}
+    presented = data.get('refreshToken')
+    if not isinstance(presented, str) or not presented:
+        return jsonify({'error': 'refreshToken is required'}), 400
+    digest = _refresh_digest(presented)
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor()
+    try:
+        if data.get('all'):
+            cursor.execute("SELECT user_id FROM refresh_tokens WHERE token_hash=%s", (digest,))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(
+                    "UPDATE refresh_tokens SET revoked_at=UTC_TIMESTAMP() WHERE user_id=%s AND revoked_at IS NULL",
+                    (row[0],)
+                )
+        else:
+            cursor.execute(
+                "UPDATE refresh_tokens SET revoked_at=UTC_TIMESTAMP() WHERE token_hash=%s AND revoked_at IS NULL",
+                (digest,)
+            )
+        conn.commit()
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({'error': f'Failed to revoke token: {err}'}), 500
+    finally:
+        cursor.close()
+        conn.close()
+    return jsonify({'revoked': True}), 200
 
 
 
@@ -337,5 +505,7 @@ if __name__ == '__main__':
         raise SystemExit(0)
     signal.signal(signal.SIGTERM, _graceful)
     signal.signal(signal.SIGINT, _graceful)
+    # Start hash workers before the first login needs them
+    hash_pool.start()
     port = int(os.environ.get('FLASK_RUN_PORT', 8082))
     app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
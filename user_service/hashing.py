@@ -0,0 +1,119 @@
+"""Password hashing off the request threads.
+
+PBKDF2 runs in a dedicated process pool so a login burst uses at most
+HASH_WORKERS cores and never holds the GIL that read endpoints need. At most
+HASH_MAX_PENDING hashes may be queued or running; beyond that, and when a
+hash does not finish within HASH_TIMEOUT, callers get Overloaded and the
+handler answers 503.
+
+Workers come from a forkserver rather than being forked from the threaded
+server, so a pool rebuilt after a worker dies cannot inherit a lock held by
+another thread. The forkserver preloads werkzeug.security; each worker
+still imports the main module as __mp_main__, so app.py keeps its startup
+DB work out of that import. start() launches the workers ahead of the
+first login.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class Overloaded(Exception):
+    """The hash queue is full or a hash did not finish in time."""
+
+
+def _context():
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(['werkzeug.security'])
+    return ctx
+
+
+class HashPool:
+    def __init__(self, workers=1, max_pending=4, timeout=10.0):
+        self.workers = max(int(workers), 1)
+        self.max_pending = max(int(max_pending), 1)
+        self.timeout = float(timeout)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._stats = {'hashed': 0, 'rejected': 0, 'timeouts': 0, 'restarts': 0}
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_context())
+            return self._executor
+
+    def _reset(self, broken):
+        # A worker died (e.g. OOM-killed); later callers get a fresh pool
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self._stats['restarts'] += 1
+        broken.shutdown(wait=False)
+
+    def start(self):
+        """Start the workers now (their first submit would otherwise do it)."""
+        self._pool().submit(int).result()
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise Overloaded(f'{self.max_pending} password hashes already pending')
+        pool = self._pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._reset(pool)
+            self._slots.release()
+            raise Overloaded('hash workers restarting')
+        with self._lock:
+            self._pending += 1
+        # The slot is held until the hash really finishes, even if we stop waiting
+        future.add_done_callback(self._done)
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise Overloaded(f'password hash took longer than {self.timeout}s')
+        except BrokenProcessPool:
+            self._reset(pool)
+            raise Overloaded('hash workers restarting')
+        with self._lock:
+            self._stats['hashed'] += 1
+        return result
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out.update({'workers': self.workers, 'pending': self._pending, 'maxPending': self.max_pending})
+        return out
+
+
+def pool_from_env():
+    # Default to half the cores so hashing cannot crowd out read traffic
+    workers = int(os.environ.get('HASH_WORKERS', str(max((os.cpu_count() or 2) // 2, 1))))
+    return HashPool(
+        workers=workers,
+        max_pending=int(os.environ.get('HASH_MAX_PENDING', str(workers * 4))),
+        timeout=float(os.environ.get('HASH_TIMEOUT', '10')),
+    )
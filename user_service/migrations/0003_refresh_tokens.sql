@@ -0,0 +1,13 @@
+-- Opaque refresh tokens, stored only as HMAC-SHA256 digests; rotated on every use
+USE user_db;
+
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    token_hash CHAR(64) PRIMARY KEY,
+    user_id VARCHAR(36) NOT NULL,
+    expires_at DATETIME NOT NULL,
+    revoked_at DATETIME NULL,
+    replaced_by CHAR(64) NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    INDEX idx_refresh_user (user_id)
+);
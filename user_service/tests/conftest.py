@@ -0,0 +1,35 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(SERVICE_DIR), 'common'))
+
+import fake_mysql  # noqa: E402
+
+SCHEMA = """
+    CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, email TEXT NOT NULL, password_hash TEXT NOT NULL);
+    CREATE TABLE refresh_tokens (
+        token_hash TEXT PRIMARY KEY, user_id TEXT NOT NULL, expires_at DATETIME NOT NULL,
+        revoked_at DATETIME NULL, replaced_by TEXT NULL, created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+@pytest.fixture(scope='session')
+def user_app():
+    # Loaded under its own name: every service has an app.py
+    spec = importlib.util.spec_from_file_location('user_service_app', os.path.join(SERVICE_DIR, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def db(user_app, monkeypatch, tmp_path):
+    database = fake_mysql.Database(tmp_path / 'user.db', SCHEMA)
+    monkeypatch.setattr(user_app, 'get_db_connection', database.connect)
+    return database
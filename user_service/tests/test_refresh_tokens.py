@@ -0,0 +1,93 @@
+import jwt
+import pytest
+
+
+@pytest.fixture
+def client(user_app, db):
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES ('u1', 'alice', 'a@example.com', 'x')")
+    db.execute("INSERT INTO users (id, username, email, password_hash) VALUES ('u2', 'bob', 'b@example.com', 'x')")
+    return user_app.app.test_client()
+
+
+def session(user_app, db, user_id='u1'):
+    """A refresh token as issued by /login."""
+    conn = db.connect()
+    token = user_app._store_refresh_token(conn.cursor(), user_id)
+    conn.commit()
+    conn.close()
+    return token
+
+
+def refresh(client, token):
+    return client.post('/api/v1/token/refresh', json={'refreshToken': token})
+
+
+def live(db, user_id):
+    return db.execute(
+        "SELECT COUNT(*) FROM refresh_tokens WHERE user_id = %s AND revoked_at IS NULL", (user_id,)
+    )[0][0]
+
+
+def test_refresh_rotates_token(user_app, db, client):
+    old = session(user_app, db)
+    r = refresh(client, old)
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body['id'] == 'u1' and body['refreshToken'] != old
+    claims = jwt.decode(body['token'], user_app.JWT_SECRET, algorithms=[user_app.JWT_ALG])
+    assert claims['sub'] == 'u1' and claims['username'] == 'alice'
+    assert body['expiresIn'] == user_app.JWT_TTL_SECONDS
+    replaced_by = db.execute(
+        "SELECT replaced_by FROM refresh_tokens WHERE token_hash = %s", (user_app._refresh_digest(old),)
+    )[0][0]
+    assert replaced_by == user_app._refresh_digest(body['refreshToken'])
+    assert refresh(client, body['refreshToken']).status_code == 200
+
+
+def test_only_digests_are_stored(user_app, db, client):
+    token = session(user_app, db)
+    stored = [r[0] for r in db.execute("SELECT token_hash FROM refresh_tokens")]
+    assert token not in stored and user_app._refresh_digest(token) in stored
+
+
+def test_reuse_of_rotated_token_revokes_all_sessions(user_app, db, client):
+    old = session(user_app, db)
+    other_device = session(user_app, db)
+    bystander = session(user_app, db, 'u2')
+    new = refresh(client, old).get_json()['refreshToken']
+    r = refresh(client, old)
+    assert r.status_code == 401
+    assert live(db, 'u1') == 0
+    assert refresh(client, new).status_code == 401
+    assert refresh(client, other_device).status_code == 401
+    # Other users keep their sessions
+    assert refresh(client, bystander).status_code == 200
+
+
+def test_logged_out_token_is_rejected_without_revoking_others(user_app, db, client):
+    token = session(user_app, db)
+    other = session(user_app, db)
+    assert client.post('/api/v1/token/revoke', json={'refreshToken': token}).get_json() == {'revoked': True}
+    assert refresh(client, token).status_code == 401
+    assert refresh(client, other).status_code == 200
+
+
+def test_revoke_all(user_app, db, client):
+    token = session(user_app, db)
+    session(user_app, db)
+    assert client.post('/api/v1/token/revoke', json={'refreshToken': token, 'all': True}).get_json() == {'revoked': True}
+    assert live(db, 'u1') == 0
+
+
+def test_revoke_answer_does_not_reveal_the_token_state(user_app, db, client):
+    token = session(user_app, db)
+    answers = [client.post('/api/v1/token/revoke', json={'refreshToken': t}) for t in (token, token, 'not-a-token')]
+    assert {(r.status_code, r.get_data()) for r in answers} == {(200, answers[0].get_data())}
+
+
+def test_expired_and_unknown_tokens_are_rejected(user_app, db, client):
+    token = session(user_app, db)
+    db.execute("UPDATE refresh_tokens SET expires_at = datetime('now', '-1 seconds')")
+    assert refresh(client, token).status_code == 401
+    assert refresh(client, 'not-a-token').status_code == 401
+    assert refresh(client, None).status_code == 400